@@ -0,0 +1,436 @@
+"""Offline stand-ins for the GitHub API and the git remotes, to benchmark git2s3 without network access."""
+
+import hashlib
+import json
+import os
+import random
+import shutil
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+from urllib.parse import parse_qs, urlsplit
+
+# Fixed timestamp for every commit, so the same spec always generates the same repositories
+EPOCH: int = 1_700_000_000
+# Words to generate compressible content, similar to source code and docs
+WORDS: tuple = (
+    "def",
+    "return",
+    "self",
+    "import",
+    "class",
+    "value",
+    "config",
+    "repository",
+    "archive",
+    "upload",
+    "if",
+    "else",
+    "for",
+    "in",
+    "None",
+    "True",
+)
+
+
+class Spec:
+    # noinspection PyUnresolvedReferences
+    """Shape of the generated repositories.
+
+    >>> Spec
+
+    Keyword Args:
+        owner: Owner name served by the API stand-in.
+        repos: Number of repositories.
+        gists: Number of gists.
+        wiki_ratio: Fraction of the repositories that have a wiki, the rest only flag ``has_wiki``
+        files: Number of files in each repository.
+        file_size: Size of each file in bytes.
+        commits: Number of commits in each repository.
+        compressible: Fraction of the files with text content, the rest are random bytes.
+        seed: Seed for the content, so the same spec always generates the same repositories.
+    """
+
+    __slots__ = ("owner", "repos", "gists", "wiki_ratio", "files", "file_size", "commits", "compressible", "seed")
+
+    def __init__(
+        self,
+        owner: str = "bench",
+        repos: int = 20,
+        gists: int = 0,
+        wiki_ratio: float = 0.0,
+        files: int = 10,
+        file_size: int = 64 * 1024,
+        commits: int = 1,
+        compressible: float = 0.5,
+        seed: int = 0,
+    ):
+        """Instantiates the spec for the generated repositories."""
+        self.owner = owner
+        self.repos = repos
+        self.gists = gists
+        self.wiki_ratio = wiki_ratio
+        self.files = files
+        self.file_size = file_size
+        self.commits = commits
+        self.compressible = compressible
+        self.seed = seed
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Get the spec as a dictionary.
+
+        Returns:
+            Dict[str, Any]:
+            Returns the spec as a dictionary.
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def digest(self) -> str:
+        """Get a short hash of the spec, to cache the generated repositories.
+
+        Returns:
+            str:
+            Returns the hash of the spec.
+        """
+        return hashlib.sha256(json.dumps(self.to_dict(), sort_keys=True).encode()).hexdigest()[:12]
+
+    def names(self) -> Dict[str, List[str]]:
+        """Get the names of the repositories, wikis and gists.
+
+        Returns:
+            Dict[str, List[str]]:
+            Returns the names of the bare repositories to generate, by source.
+        """
+        repos = [f"repo{idx:05d}" for idx in range(self.repos)]
+        wikis = [f"{name}.wiki" for idx, name in enumerate(repos) if idx < round(self.repos * self.wiki_ratio)]
+        gists = [f"{idx:032x}" for idx in range(1, self.gists + 1)]
+        return {"repo": repos, "wiki": wikis, "gist": gists}
+
+
+def content(rng: random.Random, size: int, compressible: bool) -> bytes:
+    """Generates the content of a file.
+
+    Args:
+        rng: Seeded random number generator.
+        size: Size of the content in bytes.
+        compressible: Boolean flag to generate text instead of random bytes.
+
+    Returns:
+        bytes:
+        Returns the content of the file.
+    """
+    if not compressible:
+        return rng.randbytes(size)
+    text = bytearray()
+    while len(text) < size:
+        text += (" ".join(rng.choices(WORDS, k=12)) + "\n").encode()
+    return bytes(text[:size])
+
+
+def fast_import(spec: Spec, name: str) -> bytes:
+    """Generates the ``git fast-import`` stream for a repository.
+
+    Args:
+        spec: Shape of the generated repositories.
+        name: Name of the repository, which is also part of the seed.
+
+    See Also:
+        - The first commit adds all the files, and every following commit rewrites one of them.
+
+    Returns:
+        bytes:
+        Returns the fast-import stream.
+    """
+    rng = random.Random(f"{spec.seed}:{name}")
+    stream = bytearray()
+    mark = 0
+    for commit in range(spec.commits):
+        changes = []
+        indices = range(spec.files) if commit == 0 else [commit % spec.files]
+        for idx in indices:
+            mark += 1
+            data = content(rng, spec.file_size, idx < spec.files * spec.compressible)
+            stream += b"blob\nmark :%d\ndata %d\n%s\n" % (mark, len(data), data)
+            changes.append(b"M 100644 :%d src/file%05d.txt\n" % (mark, idx))
+        message = f"Commit {commit} of {name}".encode()
+        stream += b"commit refs/heads/main\n"
+        stream += b"committer Benchmark <benchmark@example.com> %d +0000\n" % (EPOCH + commit)
+        stream += b"data %d\n%s\n" % (len(message), message)
+        stream += b"".join(changes) + b"\n"
+    return bytes(stream)
+
+
+def generate(root: str | os.PathLike, spec: Spec) -> str:
+    """Generates the bare repositories for a spec, unless they were already generated.
+
+    Args:
+        root: Directory to cache the generated repositories.
+        spec: Shape of the generated repositories.
+
+    Returns:
+        str:
+        Returns the directory with the bare repositories.
+    """
+    directory = os.path.join(root, spec.digest())
+    marker = os.path.join(directory, "spec.json")
+    if os.path.isfile(marker):
+        return directory
+    if os.path.isdir(directory):
+        # partially generated by an interrupted run
+        shutil.rmtree(directory)
+    for names in spec.names().values():
+        for name in names:
+            bare = os.path.join(directory, spec.owner, f"{name}.git")
+            subprocess.run(["git", "init", "--quiet", "--bare", bare], check=True)
+            subprocess.run(["git", "symbolic-ref", "HEAD", "refs/heads/main"], cwd=bare, check=True)
+            subprocess.run(["git", "fast-import", "--quiet"], cwd=bare, input=fast_import(spec, name), check=True)
+    with open(marker, "w") as stream:
+        json.dump(spec.to_dict(), stream, indent=2)
+    return directory
+
+
+class GitHubStub(ThreadingHTTPServer):
+    # noinspection PyUnresolvedReferences
+    """Local HTTP server that mimics the GitHub API and serves the generated repositories.
+
+    >>> GitHubStub
+
+    Keyword Args:
+        directory: Directory with the generated bare repositories.
+        spec: Shape of the generated repositories.
+        latency: Delay in seconds for every API response, to mimic the round trip to GitHub.
+
+    See Also:
+        - ``/users/<owner>/repos`` and ``/users/<owner>/gists`` are paginated with ``Link`` headers like GitHub.
+        - ``/graphql`` serves ``repositoryOwner.repositories`` with cursor based pagination.
+        - Repositories are served over git's smart HTTP protocol with ``git http-backend``
+    """
+
+    daemon_threads = True
+
+    def __init__(self, directory: str, spec: Spec, latency: float = 0.0):
+        """Binds the server to a free port on the loopback interface."""
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.directory = directory
+        self.spec = spec
+        self.latency = latency
+        self.url = f"http://127.0.0.1:{self.server_port}"
+        self.names = spec.names()
+        self.requests = 0
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    def __enter__(self) -> "GitHubStub":
+        """Starts serving in a background thread."""
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        """Stops the server."""
+        self.shutdown()
+        self.server_close()
+
+    def head(self, name: str) -> str:
+        """Get the HEAD commit of a generated repository.
+
+        Args:
+            name: Name of the repository.
+
+        Returns:
+            str:
+            Returns the SHA of the ``main`` branch.
+        """
+        with open(os.path.join(self.directory, self.spec.owner, f"{name}.git", "refs", "heads", "main")) as stream:
+            return stream.read().strip()
+
+    def repos(self) -> List[Dict[str, Any]]:
+        """Get the repositories in the shape of the REST API response.
+
+        Returns:
+            List[Dict[str, Any]]:
+            Returns the list of repositories.
+        """
+        return [
+            {
+                "id": idx,
+                "name": name,
+                "clone_url": f"{self.url}/git/{self.spec.owner}/{name}.git",
+                "description": f"Benchmark repository {idx}",
+                "private": idx % 2 == 0,
+                "pushed_at": "2024-01-01T00:00:00Z",
+                "updated_at": "2024-01-01T00:00:00Z",
+                # GitHub flags every repository with 'has_wiki', whether it has one or not
+                "has_wiki": True,
+                "size": self.spec.files * self.spec.file_size // 1024,
+            }
+            for idx, name in enumerate(self.names["repo"])
+        ]
+
+    def gists(self, api_url: str) -> List[Dict[str, Any]]:
+        """Get the gists in the shape of the REST API response.
+
+        Args:
+            api_url: Base URL of the API, which is part of the comments URL that identifies a gist.
+
+        Returns:
+            List[Dict[str, Any]]:
+            Returns the list of gists.
+        """
+        return [
+            {
+                "id": name,
+                "git_pull_url": f"{self.url}/git/{self.spec.owner}/{name}.git",
+                "comments_url": f"{api_url}/gists/{name}/comments",
+                "description": f"Benchmark gist {name}",
+                "public": True,
+                "updated_at": "2024-01-01T00:00:00Z",
+            }
+            for name in self.names["gist"]
+        ]
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Request handler for the GitHub stand-in.
+
+    >>> Handler
+
+    """
+
+    server: GitHubStub
+
+    def log_message(self, *args) -> None:
+        """Silences the access log."""
+
+    def do_GET(self) -> None:
+        """Serves the REST API and the git remotes."""
+        url = urlsplit(self.path)
+        if url.path.startswith("/git/"):
+            return self.git(url.path.removeprefix("/git"), url.query)
+        owner = self.server.spec.owner
+        time.sleep(self.server.latency)
+        if url.path == f"/users/{owner}":
+            return self.respond({"login": owner, "type": "User"})
+        if url.path in (f"/users/{owner}/repos", f"/users/{owner}/gists"):
+            if url.path.endswith("/repos"):
+                items = self.server.repos()
+            else:
+                items = self.server.gists(self.server.url)
+            query = parse_qs(url.query)
+            per_page = int(query.get("per_page", ["30"])[0])
+            page = int(query.get("page", ["1"])[0])
+            last = max(-(-len(items) // per_page), 1)
+            links = [f'<{self.server.url}{url.path}?per_page={per_page}&page={last}>; rel="last"']
+            if page < last:
+                links.insert(0, f'<{self.server.url}{url.path}?per_page={per_page}&page={page + 1}>; rel="next"')
+            first = (page - 1) * per_page
+            return self.respond(items[first:][:per_page], {"Link": ", ".join(links)})
+        return self.respond({"message": "Not Found"}, status=404)
+
+    def do_POST(self) -> None:
+        """Serves the GraphQL API and the git remotes."""
+        url = urlsplit(self.path)
+        if url.path.startswith("/git/"):
+            return self.git(url.path.removeprefix("/git"), url.query)
+        time.sleep(self.server.latency)
+        if url.path != "/graphql":
+            return self.respond({"message": "Not Found"}, status=404)
+        variables = json.loads(self.rfile.read(int(self.headers["Content-Length"])))["variables"]
+        start = int(variables.get("after") or 0)
+        repos = self.server.repos()
+        chunk = repos[start:][: variables["first"]]
+        nodes = [
+            {
+                "databaseId": repo["id"],
+                "name": repo["name"],
+                "url": repo["clone_url"].removesuffix(".git"),
+                "description": repo["description"],
+                "isPrivate": repo["private"],
+                "pushedAt": repo["pushed_at"],
+                "updatedAt": repo["updated_at"],
+                "hasWikiEnabled": repo["has_wiki"],
+                "diskUsage": repo["size"],
+                "defaultBranchRef": {"target": {"oid": self.server.head(repo["name"])}},
+            }
+            for repo in chunk
+        ]
+        end = start + len(chunk)
+        page_info = {"hasNextPage": end < len(repos), "endCursor": str(end)}
+        self.respond({"data": {"repositoryOwner": {"repositories": {"pageInfo": page_info, "nodes": nodes}}}})
+
+    def respond(self, payload: Any, headers: Dict[str, str] | None = None, status: int = 200) -> None:
+        """Sends a JSON response, with a rate limit that is never exhausted.
+
+        Args:
+            payload: JSON payload.
+            headers: Additional response headers.
+            status: HTTP status code.
+        """
+        body = json.dumps(payload).encode()
+        self.server.requests += 1
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-RateLimit-Limit", "5000")
+        self.send_header("X-RateLimit-Remaining", "5000")
+        self.send_header("X-RateLimit-Reset", str(int(time.time()) + 3600))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def body(self) -> bytes:
+        """Reads the request body, which git sends chunked when it is large.
+
+        Returns:
+            bytes:
+            Returns the request body.
+        """
+        if self.headers.get("Transfer-Encoding", "").lower() != "chunked":
+            return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        data = bytearray()
+        while size := int(self.rfile.readline().strip(), 16):
+            data += self.rfile.read(size)
+            self.rfile.readline()
+        self.rfile.readline()
+        return bytes(data)
+
+    def git(self, path: str, query: str) -> None:
+        """Serves a repository over the smart HTTP protocol, by running ``git http-backend`` as a CGI.
+
+        Args:
+            path: Path of the repository within the generated directory, along with the service.
+            query: Query string of the request.
+        """
+        env = {
+            **os.environ,
+            "GIT_PROJECT_ROOT": self.server.directory,
+            "GIT_HTTP_EXPORT_ALL": "1",
+            "PATH_INFO": path,
+            "QUERY_STRING": query,
+            "REQUEST_METHOD": self.command,
+            "CONTENT_TYPE": self.headers.get("Content-Type", ""),
+            "REMOTE_ADDR": self.client_address[0],
+        }
+        if encoding := self.headers.get("Content-Encoding"):
+            env["HTTP_CONTENT_ENCODING"] = encoding
+        if protocol := self.headers.get("Git-Protocol"):
+            env["GIT_PROTOCOL"] = protocol
+        stdin = self.body() if self.command == "POST" else b""
+        env["CONTENT_LENGTH"] = str(len(stdin))
+        process = subprocess.run(["git", "http-backend"], input=stdin, env=env, capture_output=True)
+        head, _, payload = process.stdout.partition(b"\r\n\r\n")
+        status = 200
+        headers = []
+        for line in head.decode().splitlines():
+            key, _, value = line.partition(":")
+            if key.lower() == "status":
+                status = int(value.split()[0])
+            else:
+                headers.append((key, value.strip()))
+        self.send_response(status)
+        for key, value in headers:
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
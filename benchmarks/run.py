@@ -0,0 +1,347 @@
+"""Benchmarks an end-to-end backup against local stand-ins for GitHub, git remotes and S3.
+
+Usage:
+    python benchmarks/run.py --repos 50 --file-size 262144 --rounds 3 PIPELINE=true ARCHIVE_FORMAT=tar_zst
+
+See Also:
+    - Positional ``KEY=VALUE`` arguments are passed to git2s3 as environment variables.
+    - Each round runs in a child process, so its peak memory isn't skewed by the stand-ins.
+    - Results are compared against ``--baseline`` (a previous ``--output``) to catch regressions.
+"""
+
+import argparse
+import json
+import logging
+import os
+import resource
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List
+
+import boto3
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import fixtures  # noqa: E402
+from git2s3 import squire  # noqa: E402
+
+# Metrics where a lower value is better, which are checked against the baseline
+REGRESSIONS: tuple = ("duration", "peak_disk", "peak_rss")
+# Seconds between samples of the disk usage
+SAMPLE_INTERVAL: float = 0.1
+
+
+class DiskSampler(threading.Thread):
+    # noinspection PyUnresolvedReferences
+    """Samples the size of the directories used by a run in the background, to get the peak disk usage.
+
+    >>> DiskSampler
+
+    Keyword Args:
+        directories: Directories to sample.
+    """
+
+    def __init__(self, directories: List[str]):
+        """Instantiates the sampler as a daemon thread."""
+        super().__init__(daemon=True)
+        self.directories = directories
+        self.peak = 0
+        self.done = threading.Event()
+
+    def run(self) -> None:
+        """Samples the directories until the run is complete."""
+        while not self.done.wait(SAMPLE_INTERVAL):
+            self.sample()
+
+    def sample(self) -> None:
+        """Samples the directories once."""
+        size = 0
+        for directory in self.directories:
+            try:
+                size += squire.directory_size(directory)
+            except OSError:
+                # files are removed while they are being walked
+                continue
+        self.peak = max(self.peak, size)
+
+    def stop(self) -> int:
+        """Stops sampling.
+
+        Returns:
+            int:
+            Returns the peak size in bytes.
+        """
+        self.done.set()
+        self.join()
+        self.sample()
+        return self.peak
+
+
+def free_port() -> int:
+    """Get a free port on the loopback interface.
+
+    Returns:
+        int:
+        Returns the port number.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def child(result_file: str) -> None:
+    """Runs a backup with the configuration from the environment, and stores its metrics.
+
+    Args:
+        result_file: Filepath to store the metrics of the run.
+    """
+    import git2s3
+
+    backup = git2s3.Git2S3(env_file=os.path.join(os.getcwd(), ".env"))
+    backup.start()
+    report = backup.metrics.report(backup.clones)
+    # kilobytes on Linux, bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    report["peak_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    report["peak_rss_children"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    with open(result_file, "w") as stream:
+        json.dump(report, stream)
+
+
+def run_round(idx: int, env: Dict[str, str], workdir: str, verbose: bool) -> Dict[str, Any]:
+    """Runs a single round of the benchmark in a child process.
+
+    Args:
+        idx: Index of the round.
+        env: Environment variables for the child process.
+        workdir: Directory for the backup and the logs of the round.
+        verbose: Boolean flag to show the logs of the child process.
+
+    Returns:
+        Dict[str, Any]:
+        Returns the metrics of the round.
+    """
+    backup_dir = os.path.join(workdir, f"round{idx}")
+    os.makedirs(backup_dir)
+    result_file = os.path.join(workdir, f"round{idx}.json")
+    env = {**env, "BACKUP_DIR": backup_dir, "AWS_S3_PREFIX": f"benchmark/round{idx}"}
+    directories = [backup_dir] + [env[key] for key in ("MIRROR_DIR",) if env.get(key)]
+    sampler = DiskSampler(directories)
+    sampler.start()
+    start = time.perf_counter()
+    with open(os.path.join(workdir, f"round{idx}.log"), "w") as log:
+        process = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", result_file],
+            cwd=backup_dir,
+            env=env,
+            stdout=None if verbose else log,
+            stderr=subprocess.STDOUT,
+        )
+    elapsed = time.perf_counter() - start
+    peak_disk = sampler.stop()
+    if process.returncode or not os.path.isfile(result_file):
+        raise SystemExit(f"Round {idx} failed, see the logs at: {workdir}")
+    with open(result_file) as stream:
+        report = json.load(stream)
+    # a round with failures skips the work it failed on, so its timings can't be compared against a full round
+    if failed := {source: counter["failed"] for source, counter in report["counters"].items() if counter.get("failed")}:
+        raise SystemExit(f"Round {idx} failed for {failed}, see the logs at: {workdir}")
+    report["wall"] = elapsed
+    report["peak_disk"] = peak_disk
+    shutil.rmtree(backup_dir, ignore_errors=True)
+    return report
+
+
+def summarize(reports: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Summarizes the rounds with the median of each metric.
+
+    Args:
+        reports: Metrics of each round.
+
+    Returns:
+        Dict[str, Any]:
+        Returns the median of each metric across the rounds.
+    """
+    summary = {
+        "rounds": len(reports),
+        "duration": statistics.median(report["duration"] for report in reports),
+        "repos_per_min": statistics.median(report["throughput"]["repos_per_min"] for report in reports),
+        "mb_per_sec": statistics.median(report["throughput"]["mb_per_sec"] for report in reports),
+        "peak_disk": statistics.median(report["peak_disk"] for report in reports),
+        "peak_rss": statistics.median(report["peak_rss"] for report in reports),
+        "peak_rss_children": statistics.median(report["peak_rss_children"] for report in reports),
+        "counters": reports[-1]["counters"],
+        "phases": {},
+    }
+    for phase in reports[-1]["phases"]:
+        summary["phases"][phase] = {
+            key: statistics.median(report["phases"][phase][key] for report in reports)
+            for key in reports[-1]["phases"][phase]
+        }
+    return summary
+
+
+def compare(summary: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Compares the summary against a baseline.
+
+    Args:
+        summary: Summary of the current benchmark.
+        baseline: Summary of a previous benchmark.
+        tolerance: Fraction a metric can grow by, before it is flagged as a regression.
+
+    Returns:
+        List[str]:
+        Returns the list of regressions.
+    """
+    regressions = []
+    for key in REGRESSIONS:
+        previous, current = baseline["summary"].get(key), summary[key]
+        if previous and current > previous * (1 + tolerance):
+            regressions.append(f"{key}: {previous:.2f} -> {current:.2f} (+{(current / previous - 1) * 100:.1f}%)")
+    return regressions
+
+
+def display(summary: Dict[str, Any]) -> None:
+    """Prints the summary.
+
+    Args:
+        summary: Summary of the benchmark.
+    """
+    print(f"\nMedian of {summary['rounds']} round(s)")
+    print(f"  duration:     {summary['duration']:.2f}s")
+    print(f"  throughput:   {summary['repos_per_min']:.1f} repos/min, {summary['mb_per_sec']:.2f} MB/s uploaded")
+    print(f"  peak disk:    {summary['peak_disk'] / 1_000_000:.1f} MB")
+    print(f"  peak RSS:     {summary['peak_rss'] / 1_000_000:.1f} MB (largest child: ", end="")
+    print(f"{summary['peak_rss_children'] / 1_000_000:.1f} MB)")
+    print(f"\n  {'phase':<8} {'items':>6} {'MB':>10} {'busy (s)':>9} {'MB/s':>8} {'p50 (s)':>8} {'p95 (s)':>8}")
+    for phase, stats in summary["phases"].items():
+        print(
+            f"  {phase:<8} {stats['count']:>6.0f} {stats['bytes'] / 1_000_000:>10.1f} {stats['seconds']:>9.2f} "
+            f"{stats['mb_per_sec']:>8.2f} {stats['p50']:>8.3f} {stats['p95']:>8.3f}"
+        )
+
+
+def main() -> None:
+    """Generates the fixtures, starts the stand-ins and runs the benchmark."""
+    parser = argparse.ArgumentParser(description="Benchmark git2s3 against local stand-ins.")
+    parser.add_argument("overrides", nargs="*", help="git2s3 environment variables as KEY=VALUE")
+    parser.add_argument("--repos", type=int, default=20, help="Number of repositories.")
+    parser.add_argument("--gists", type=int, default=0, help="Number of gists.")
+    parser.add_argument("--wiki-ratio", type=float, default=0.0, help="Fraction of the repositories with a wiki.")
+    parser.add_argument("--files", type=int, default=10, help="Number of files in each repository.")
+    parser.add_argument("--file-size", type=int, default=64 * 1024, help="Size of each file in bytes.")
+    parser.add_argument("--commits", type=int, default=1, help="Number of commits in each repository.")
+    parser.add_argument("--compressible", type=float, default=0.5, help="Fraction of the files with text.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the generated content.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Delay in seconds for every API response.")
+    parser.add_argument("--rounds", type=int, default=1, help="Number of rounds, the median is reported.")
+    parser.add_argument(
+        "--fixtures",
+        default=os.path.join(tempfile.gettempdir(), "git2s3-benchmark"),
+        help="Directory to cache the generated repositories.",
+    )
+    parser.add_argument("--endpoint-url", help="S3 compatible endpoint to use instead of an in-process moto server.")
+    parser.add_argument("--bucket", default="git2s3-benchmark", help="Bucket to upload to.")
+    parser.add_argument("--output", help="Filepath to store the results.")
+    parser.add_argument("--baseline", help="Results of a previous benchmark to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed regression against the baseline.")
+    parser.add_argument("--verbose", action="store_true", help="Show the logs of each round.")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args.child)
+
+    spec = fixtures.Spec(
+        repos=args.repos,
+        gists=args.gists,
+        wiki_ratio=args.wiki_ratio,
+        files=args.files,
+        file_size=args.file_size,
+        commits=args.commits,
+        compressible=args.compressible,
+        seed=args.seed,
+    )
+    start = time.perf_counter()
+    directory = fixtures.generate(args.fixtures, spec)
+    print(f"Fixtures ready in {time.perf_counter() - start:.1f}s: [{directory}]")
+
+    moto_server = None
+    endpoint_url = args.endpoint_url
+    if not endpoint_url:
+        try:
+            from moto.server import ThreadedMotoServer
+        except ImportError:
+            raise SystemExit("An S3 stand-in is required, install it with: pip install 'moto[server]'")
+        port = free_port()
+        # the access log of every request would bury the results
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        moto_server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+        moto_server.start()
+        endpoint_url = f"http://127.0.0.1:{port}"
+    credentials = {
+        "AWS_ACCESS_KEY_ID": os.environ.get("AWS_ACCESS_KEY_ID", "benchmark"),
+        "AWS_SECRET_ACCESS_KEY": os.environ.get("AWS_SECRET_ACCESS_KEY", "benchmark"),
+        "AWS_REGION_NAME": os.environ.get("AWS_REGION_NAME", "us-east-1"),
+    }
+    s3_client = boto3.client(
+        "s3",
+        endpoint_url=endpoint_url,
+        aws_access_key_id=credentials["AWS_ACCESS_KEY_ID"],
+        aws_secret_access_key=credentials["AWS_SECRET_ACCESS_KEY"],
+        region_name=credentials["AWS_REGION_NAME"],
+    )
+    try:
+        s3_client.create_bucket(Bucket=args.bucket)
+    except s3_client.exceptions.BucketAlreadyOwnedByYou:
+        pass
+
+    workdir = tempfile.mkdtemp(prefix="git2s3-benchmark-")
+    reports = []
+    try:
+        with fixtures.GitHubStub(directory, spec, args.latency) as stub:
+            env = {
+                **os.environ,
+                **credentials,
+                "GIT_API_URL": stub.url,
+                "GIT_OWNER": spec.owner,
+                "GIT_TOKEN": "benchmark",
+                "AWS_BUCKET_NAME": args.bucket,
+                "AWS_ENDPOINT_URL": endpoint_url,
+                "SOURCE": json.dumps(["repo"] + ["gist"] * bool(spec.gists) + ["wiki"] * bool(spec.wiki_ratio)),
+            }
+            for override in args.overrides:
+                key, _, value = override.partition("=")
+                env[key.upper()] = value
+            for idx in range(args.rounds):
+                report = run_round(idx, env, workdir, args.verbose)
+                print(f"Round {idx}: {report['duration']:.2f}s, {report['throughput']['repos_per_min']:.1f} repos/min")
+                reports.append(report)
+    finally:
+        if moto_server:
+            moto_server.stop()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    summary = summarize(reports)
+    display(summary)
+    result = {"spec": spec.to_dict(), "overrides": args.overrides, "summary": summary, "rounds": reports}
+    if args.output:
+        with open(args.output, "w") as stream:
+            json.dump(result, stream, indent=2)
+        print(f"\nResults stored at: [{args.output}]")
+    if args.baseline:
+        with open(args.baseline) as stream:
+            baseline = json.load(stream)
+        if regressions := compare(summary, baseline, args.tolerance):
+            print("\nRegressions against the baseline:\n  " + "\n  ".join(regressions))
+            raise SystemExit(1)
+        print("\nNo regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,9 @@ import sys
 
 import click
 
+from git2s3 import config, s3, scheduler, squire
 from git2s3.main import Git2S3
+from git2s3.scheduler import Scheduler
 
 version = "0.1.1"
 
@@ -12,6 +14,9 @@ version = "0.1.1"
 @click.command()
 @click.argument("start", required=False)
 @click.argument("run", required=False)
+@click.argument("gc", required=False)
+@click.argument("resume", required=False)
+@click.argument("merge", required=False)
 @click.option("--version", "-V", is_flag=True, help="Prints the version.")
 @click.option("--help", "-H", is_flag=True, help="Prints the help section.")
 @click.option(
@@ -20,6 +25,7 @@ version = "0.1.1"
     type=click.Path(exists=True),
     help="Environment configuration filepath.",
 )
+@click.option("--shard", "-S", help="Shard of the repos/gists to back up, as INDEX/COUNT (eg: 3/8).")
 def commandline(*args, **kwargs) -> None:
     """Starter function to invoke Git2S3 via CLI commands.
 
@@ -27,16 +33,24 @@ def commandline(*args, **kwargs) -> None:
         - ``--version | -V``: Prints the version.
         - ``--help | -H``: Prints the help section.
         - ``--env | -E``: Environment configuration filepath.
+        - ``--shard | -S``: Shard of the repos/gists to back up, as INDEX/COUNT (eg: 3/8).
 
     **Commands**
         ``start | run``: Initiates the backup process.
+        ``gc``: Deletes the expired snapshots and unreferenced blobs from the content addressed store.
+        ``resume``: Resumes an interrupted backup process from its journal.
+        ``merge``: Assembles the manifests of a snapshot from the parts stored by each shard.
     """
     assert sys.argv[0].endswith("git2s3"), "Invalid commandline trigger!!"
     options = {
         "--version | -V": "Prints the version.",
         "--help | -H": "Prints the help section.",
         "--env | -E": "Environment configuration filepath.",
+        "--shard | -S": "Shard of the repos/gists to back up, as INDEX/COUNT (eg: 3/8).",
         "start | run": "Initiates the backup process.",
+        "gc": "Deletes the expired snapshots and unreferenced blobs from the content addressed store.",
+        "resume": "Resumes an interrupted backup process from its journal.",
+        "merge": "Assembles the manifests of a snapshot from the parts stored by each shard.",
     }
     # weird way to increase spacing to keep all values monotonic
     _longest_key = len(max(options.keys()))
@@ -50,9 +64,26 @@ def commandline(*args, **kwargs) -> None:
     if kwargs.get("help"):
         click.echo(f"\nUsage: git2s3 [arbitrary-command]\nOptions (and corresponding behavior):{choices}")
         sys.exit(0)
-    trigger = kwargs.get("start") or kwargs.get("run")
-    if trigger and trigger.lower() in ("start", "run"):
-        Git2S3(env_file=kwargs.get("env") or ".env").start()
+    trigger = (
+        kwargs.get("start") or kwargs.get("run") or kwargs.get("gc") or kwargs.get("resume") or kwargs.get("merge")
+    )
+    if trigger and trigger.lower() in ("start", "run", "resume"):
+        env = squire.env_loader(kwargs.get("env") or ".env")
+        if kwargs.get("shard"):
+            # validated again, so the shard is checked along with the rest of the configuration
+            env = config.EnvConfig(**{**env.model_dump(exclude_unset=True, warnings=False), "shard": kwargs["shard"]})
+        # multiple owners share the same pools, instead of running a backup for each owner
+        if env.git_owners:
+            sys.exit(0 if Scheduler(env=env, resume=trigger.lower() == "resume").start() else 1)
+        Git2S3(env=env, resume=trigger.lower() == "resume").start()
+        sys.exit(0)
+    elif trigger and trigger.lower() == "merge":
+        env = squire.env_loader(kwargs.get("env") or ".env")
+        sys.exit(0 if scheduler.merge(env, squire.default_logger(env)) else 1)
+    elif trigger and trigger.lower() == "gc":
+        env = squire.env_loader(kwargs.get("env") or ".env")
+        logger = squire.default_logger(env)
+        s3.Uploader(env, logger).gc()
         sys.exit(0)
     elif trigger:
         click.secho(f"\n{trigger!r} - Invalid command", fg="red")
@@ -0,0 +1,327 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict
+from urllib.parse import urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# Pacing kicks in when the remaining budget drops below this fraction of the limit
+LOW_WATER: float = 0.1
+# Base delay in seconds, for retrying server errors and connection errors
+BACKOFF: int = 2
+# GitHub recommends waiting at least a minute for secondary rate limits without a 'retry-after' header
+SECONDARY_BACKOFF: int = 60
+
+
+class Budget:
+    """Rate limit budget for a single API resource (``core``, ``graphql`` etc.) within the current window.
+
+    >>> Budget
+
+    """
+
+    __slots__ = ("limit", "remaining", "reset", "used", "next_slot")
+
+    def __init__(self):
+        """Instantiates an unknown budget, which is filled in by the first response."""
+        self.limit: int | None = None
+        self.remaining: int | None = None
+        self.reset: float = 0.0
+        self.used: int = 0
+        self.next_slot: float = 0.0
+
+
+class RateLimiter:
+    # noinspection PyUnresolvedReferences
+    """Schedules requests within the token's rate limit, based on the rate limit headers of the responses.
+
+    >>> RateLimiter
+
+    Keyword Args:
+        logger: Logger object.
+        share: Fraction of the token's rate limit this process is allowed to consume.
+
+    See Also:
+        - Requests are sent as fast as possible, until the budget drops below the low-water mark.
+        - Below the low-water mark, the remaining budget is spread evenly until the window resets.
+        - Processes sharing a token can split the budget with ``share``, each one only counts its own requests.
+
+    References:
+        https://docs.github.com/en/rest/using-the-rest-api/rate-limits-for-the-rest-api
+    """
+
+    def __init__(self, logger: logging.Logger, share: float = 1.0):
+        """Instantiates the rate limiter with an unknown budget."""
+        self.logger = logger
+        self.share = share
+        self.lock = threading.Lock()
+        self.budgets: Dict[str, Budget] = {}
+        self.blocked_until = 0.0
+
+    def acquire(self, resource: str) -> None:
+        """Waits until a request can be sent for the resource.
+
+        Args:
+            resource: Rate limit resource of the request.
+        """
+        with self.lock:
+            budget = self.budgets.setdefault(resource, Budget())
+            now = time.time()
+            if budget.reset and now >= budget.reset:
+                # new window, the budget is unknown until the next response
+                budget.used, budget.remaining, budget.next_slot = 0, None, 0.0
+            wait_until = max(now, self.blocked_until, budget.next_slot)
+            if budget.remaining is not None and budget.limit:
+                allowance = min(budget.remaining, int(budget.limit * self.share) - budget.used)
+                if allowance <= 0:
+                    self.logger.warning(
+                        "Rate limit budget for %r is exhausted, waiting %ds for it to reset",
+                        resource,
+                        budget.reset - now,
+                    )
+                    wait_until = max(wait_until, budget.reset)
+                elif allowance < budget.limit * self.share * LOW_WATER:
+                    budget.next_slot = wait_until + max(budget.reset - wait_until, 0) / allowance
+            budget.used += 1
+        if wait_until > now:
+            time.sleep(wait_until - now)
+
+    def update(self, resource: str, response: requests.Response) -> None:
+        """Updates the budget with the rate limit headers of a response.
+
+        Args:
+            resource: Rate limit resource of the request.
+            response: Response object from the server.
+        """
+        headers = response.headers
+        if "X-RateLimit-Remaining" not in headers:
+            return
+        resource = headers.get("X-RateLimit-Resource", resource)
+        with self.lock:
+            budget = self.budgets.setdefault(resource, Budget())
+            try:
+                budget.limit = int(headers["X-RateLimit-Limit"])
+                budget.remaining = int(headers["X-RateLimit-Remaining"])
+                budget.reset = float(headers["X-RateLimit-Reset"])
+            except (KeyError, ValueError):
+                return
+
+    def block(self, delay: float) -> None:
+        """Blocks all the requests for a while.
+
+        Args:
+            delay: Number of seconds to block the requests for.
+        """
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.time() + delay)
+
+    @staticmethod
+    def retry_delay(response: requests.Response, attempt: int) -> float | None:
+        """Get the delay before retrying a request.
+
+        Args:
+            response: Response object from the server.
+            attempt: Number of attempts that were made before this one.
+
+        Returns:
+            float:
+            Returns the number of seconds to wait before retrying, or None if the request shouldn't be retried.
+        """
+        if response.status_code in (403, 429):
+            if retry_after := response.headers.get("Retry-After"):
+                return float(retry_after)
+            if response.headers.get("X-RateLimit-Remaining") == "0":
+                return max(float(response.headers.get("X-RateLimit-Reset", 0)) - time.time(), 0) + 1
+            if "rate limit" in response.text.lower():
+                return SECONDARY_BACKOFF * 2**attempt
+            # permission errors and such are not worth retrying
+            return None
+        if response.status_code in (500, 502, 503, 504):
+            return BACKOFF * 2**attempt
+        return None
+
+
+class Session(requests.Session):
+    # noinspection PyUnresolvedReferences
+    """HTTP session for the GitHub API, paced by a rate limiter with an optional on-disk cache.
+
+    >>> Session
+
+    Keyword Args:
+        logger: Logger object.
+        cache_dir: Directory to store the cached responses, caching is disabled when not set.
+        rate_limit_share: Fraction of the token's rate limit this session is allowed to consume.
+        retries: Number of retries on rate limits, server errors and connection errors.
+
+    See Also:
+        - Requests that hit a rate limit are retried once the limit resets, instead of failing.
+        - ``ETag`` and ``Last-Modified`` headers of every successful ``GET`` response are cached along with the body.
+        - Subsequent requests send ``If-None-Match``/``If-Modified-Since``, and a ``304`` is served from the cache.
+        - GitHub doesn't count ``304`` responses against the rate limit, when the request is authorized.
+
+    References:
+        https://docs.github.com/en/rest/using-the-rest-api/best-practices-for-using-the-rest-api#use-conditional-requests-if-appropriate
+    """
+
+    def __init__(
+        self,
+        logger: logging.Logger,
+        cache_dir: str | os.PathLike | None = None,
+        rate_limit_share: float = 1.0,
+        retries: int = 5,
+    ):
+        """Instantiates the session and creates the cache directory."""
+        super().__init__()
+        self.logger = logger
+        self.limiter = RateLimiter(logger, rate_limit_share)
+        self.retries = retries
+        self.cache_dir = cache_dir
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def cache_file(self, request: requests.PreparedRequest) -> str:
+        """Get the cache file for a request.
+
+        Args:
+            request: Prepared request object.
+
+        See Also:
+            - The authorization header is part of the key, since different tokens can see different resources.
+
+        Returns:
+            str:
+            Returns the filepath of the cached response.
+        """
+        key = f"{request.url}\n{request.headers.get('Authorization', '')}"
+        return os.path.join(self.cache_dir, f"{hashlib.sha256(key.encode()).hexdigest()}.json")
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        """Sends a request through the rate limiter, retrying on rate limits and transient errors.
+
+        Args:
+            request: Prepared request object.
+            kwargs: Keyword arguments for ``requests.Session.send``
+
+        Returns:
+            requests.Response:
+            Returns the response object of the last attempt.
+        """
+        resource = "graphql" if urlsplit(request.url).path.endswith("/graphql") else "core"
+        for attempt in range(self.retries + 1):
+            self.limiter.acquire(resource)
+            try:
+                response = self.fetch(request, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as error:
+                if attempt == self.retries:
+                    raise
+                delay = BACKOFF * 2**attempt
+                self.logger.warning("Retrying %s in %ds, reason: %s", request.url, delay, error)
+                time.sleep(delay)
+                continue
+            self.limiter.update(resource, response)
+            delay = self.limiter.retry_delay(response, attempt)
+            if delay is None or attempt == self.retries:
+                return response
+            self.logger.warning(
+                "Retrying %s in %ds, reason: %d %s", request.url, delay, response.status_code, response.reason
+            )
+            response.close()
+            # rate limits apply to the token, so every request waits and not just this one
+            self.limiter.block(delay)
+
+    def fetch(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        """Sends a request, with the validators of the cached response when available.
+
+        Args:
+            request: Prepared request object.
+            kwargs: Keyword arguments for ``requests.Session.send``
+
+        Returns:
+            requests.Response:
+            Returns the response object, which is rebuilt from the cache when the server responds with ``304``
+        """
+        if not self.cache_dir or request.method != "GET":
+            return super().send(request, **kwargs)
+        cache_file = self.cache_file(request)
+        cached = None
+        if os.path.isfile(cache_file):
+            try:
+                with open(cache_file) as stream:
+                    cached = json.load(stream)
+            except (OSError, ValueError):
+                # A corrupt entry is just a cache miss
+                cached = None
+        if cached:
+            if cached.get("etag"):
+                request.headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                request.headers["If-Modified-Since"] = cached["last_modified"]
+        response = super().send(request, **kwargs)
+        if response.status_code == 304 and cached:
+            return self.from_cache(request, response, cached)
+        if response.status_code == 200 and (response.headers.get("ETag") or response.headers.get("Last-Modified")):
+            self.to_cache(cache_file, response)
+        return response
+
+    @staticmethod
+    def from_cache(
+        request: requests.PreparedRequest, response: requests.Response, cached: Dict[str, Any]
+    ) -> requests.Response:
+        """Rebuilds a response from the cache.
+
+        Args:
+            request: Prepared request object.
+            response: ``304`` response object from the server.
+            cached: Cached response.
+
+        Returns:
+            requests.Response:
+            Returns the cached response, with the headers refreshed by the ``304`` response.
+        """
+        headers = CaseInsensitiveDict(cached["headers"])
+        # rate limit headers and such are always the latest, but the body related headers belong to the cache
+        headers.update(
+            {k: v for k, v in response.headers.items() if k.lower() not in ("content-length", "content-type")}
+        )
+        rebuilt = requests.Response()
+        rebuilt.status_code = 200
+        rebuilt.reason = "OK"
+        rebuilt.headers = headers
+        rebuilt.url = response.url
+        rebuilt.request = request
+        rebuilt.encoding = response.encoding or "utf-8"
+        rebuilt.elapsed = response.elapsed
+        rebuilt.connection = response.connection
+        rebuilt._content = base64.b64decode(cached["body"])
+        response.close()
+        return rebuilt
+
+    @staticmethod
+    def to_cache(cache_file: str, response: requests.Response) -> None:
+        """Stores a response in the cache.
+
+        Args:
+            cache_file: Filepath to store the response.
+            response: Response object from the server.
+        """
+        payload = {
+            "url": response.url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "headers": {
+                k: v for k, v in response.headers.items() if k.lower() not in ("content-encoding", "content-length")
+            },
+            "body": base64.b64encode(response.content).decode(),
+        }
+        # Write to a temporary file and rename, so concurrent requests never read a partial entry
+        tmp_file = f"{cache_file}.{os.getpid()}.{id(response)}.tmp"
+        with open(tmp_file, "w") as stream:
+            json.dump(payload, stream)
+            stream.flush()
+        os.replace(tmp_file, cache_file)
@@ -6,11 +6,14 @@ from typing import List, Optional
 
 from pydantic import (
     BaseModel,
+    ByteSize,
     DirectoryPath,
     Field,
     HttpUrl,
+    NonNegativeInt,
     PositiveInt,
     field_validator,
+    model_validator,
 )
 from pydantic_settings import BaseSettings
 
@@ -24,6 +27,12 @@ else:
 
 
 BACKUP_PREFIX: str = "Git2S3_Backup_" + datetime.now().strftime("%b%d%Y_%H%M")
+STATE_PREFIX: str = "Git2S3_State"
+STATE_DIR: str = ".git2s3"
+MANIFEST_NAME: str = "git2s3_manifest.json"
+MANIFEST_PARTS: str = "git2s3_manifest_parts"
+BLOB_PREFIX: str = "Git2S3_Blobs"
+SNAPSHOT_PREFIX: str = "Git2S3_Snapshots"
 
 
 class LogOptions(StrEnum):
@@ -49,18 +58,86 @@ class SourceControl(StrEnum):
     wiki: str = "wiki"
 
 
-class DataStore(BaseModel):
-    """DataStore model to store repository/gist information.
+class ArchiveFormat(StrEnum):
+    """Available archive formats for the backup.
+
+    >>> ArchiveFormat
+
+    """
+
+    zip: str = "zip"
+    zip_store: str = "zip_store"
+    tar_gz: str = "tar_gz"
+    tar_zst: str = "tar_zst"
+    bundle: str = "bundle"
+    bundle_incremental: str = "bundle_incremental"
+
+
+class DataStore:
+    # noinspection PyUnresolvedReferences
+    """Compact record of a repository/gist/wiki, with only the fields from the API response that are used.
 
     >>> DataStore
 
+    Keyword Args:
+        source: Source type of the record.
+        clone_url: URL to clone the repository/gist from.
+        name: Name of the repository, or the ID of the gist.
+        private: Boolean flag to indicate if the repository/gist is private.
+        description: Description of the repository/gist.
+        updated_at: Latest ``pushed_at``/``updated_at`` timestamp.
+        head: HEAD SHA of the default branch, when listed with GraphQL.
+        has_wiki: Boolean flag to indicate if the repository has wikis enabled.
+        size: Size of the repository/gist in bytes.
+
+    See Also:
+        - A record is created for every repository/gist that is listed, so it uses ``__slots__`` instead of a model.
+        - The raw API response can be released right after the record is created, regardless of the size of the org.
+    """
+
+    __slots__ = ("source", "clone_url", "name", "private", "description", "updated_at", "head", "has_wiki", "size")
+
+    def __init__(
+        self,
+        source: SourceControl,
+        clone_url: str,
+        name: str,
+        private: bool,
+        description: Optional[str] = None,
+        updated_at: Optional[str] = None,
+        head: Optional[str] = None,
+        has_wiki: bool = False,
+        size: int = 0,
+    ):
+        """Instantiates the record of a repository/gist/wiki."""
+        self.source = source
+        self.clone_url = clone_url
+        self.name = name
+        self.private = private
+        self.description = description
+        self.updated_at = updated_at
+        self.head = head
+        self.has_wiki = has_wiki
+        self.size = size
+
+
+class Owner(BaseModel):
+    """Owner/organization to back up, along with the settings that override the defaults for it.
+
+    >>> Owner
+
     """
 
-    source: SourceControl
-    clone_url: HttpUrl
     name: str
-    description: Optional[str] = None
-    private: bool
+    git_ignore: Optional[List[str]] = None
+    cut_off_days: Optional[PositiveInt] = None
+
+    @field_validator("git_ignore", mode="after", check_fields=True)
+    def parse_git_ignore(cls, value: Optional[List[str]]) -> Optional[List[str]]:
+        """Convert all git_ignore values to lowercase."""
+        if value is None:
+            return value
+        return [v.lower() for v in value]
 
 
 class Boto3RetryMode(StrEnum):
@@ -84,7 +161,9 @@ class EnvConfig(BaseSettings):
     """
 
     git_api_url: HttpUrl = "https://api.github.com/"
-    git_owner: str
+    git_owner: str | None = None
+    # Back up multiple owners in a single process, sharing the connection pool and the worker pools
+    git_owners: List[Owner] = []
     git_token: str
     git_ignore: List[str] = []
     max_per_page: PositiveInt = Field(default=100, ge=1, le=100)
@@ -107,11 +186,63 @@ class EnvConfig(BaseSettings):
     aws_secret_access_key: str | None = None
     aws_region_name: str | None = None
     aws_s3_prefix: str = BACKUP_PREFIX
+    # Endpoint of an S3 compatible storage (MinIO, LocalStack etc.) instead of AWS
+    aws_endpoint_url: HttpUrl | None = None
     boto3_retry_attempts: int = 10
     boto3_retry_mode: Boto3RetryMode = Boto3RetryMode.standard
 
     # Only backup the repos that were "updated"/"pushed to" in the last N days
     cut_off_days: PositiveInt | None = None
+    # List repositories with the GraphQL API, which only fetches the fields that are required
+    graphql: bool = False
+    # Cache the API responses on disk, and revalidate them with conditional requests
+    http_cache: bool = False
+    # Fraction of the token's rate limit to consume, to split it between processes sharing the same token
+    rate_limit_share: float = Field(default=1.0, gt=0, le=1)
+    # Number of retries for API requests that hit a rate limit, a server error or a connection error
+    api_retries: NonNegativeInt = 5
+    # Concurrency for listing, cloning and uploading (network-bound) and archiving (CPU-bound)
+    api_workers: PositiveInt = 4
+    clone_workers: PositiveInt = os.cpu_count()
+    archive_workers: PositiveInt = os.cpu_count()
+    upload_workers: PositiveInt = os.cpu_count()
+    # Number of owners that are backed up concurrently, when 'git_owners' is set
+    owner_workers: PositiveInt = 4
+    # Archive in a process pool instead of a thread pool, so compression scales across cores
+    archive_processes: bool = False
+    # Upload each archive as soon as it is created, instead of waiting for all the clones to complete
+    pipeline: bool = False
+    # Stream archives straight into S3 multipart uploads without writing them to disk, requires 'pipeline'
+    stream_archive: bool = False
+    # Clone the largest repos/gists first, so they don't stretch the tail of the run
+    # Buffers the entire listing before cloning starts, and holds it in memory until all the clones are submitted
+    largest_first: bool = False
+    # Bytes the repos/gists/wikis in flight can hold on local disk (eg: '20GB'), cloning waits when it's full
+    disk_budget: ByteSize | None = None
+    # Remember the repos that flag 'has_wiki' without having one for N days, 0 to disable
+    wiki_cache_days: NonNegativeInt = 7
+    # Archive the working tree as a zip file, or all the branches and tags as a (incremental) git bundle
+    archive_format: ArchiveFormat = ArchiveFormat.zip
+    # Compression level for the archive format's codec, defaults to the codec's default level
+    compression_level: int | None = None
+    # Number of threads for compression (only tar_zst), 0 to use all the cores
+    compression_threads: NonNegativeInt = 0
+    # Persistent cache of bare mirrors, updated with 'git fetch' instead of fresh clones on every run
+    mirror_dir: pathlib.Path | None = None
+    # Skip the repos/gists/wikis that are unchanged since the last backup (tracked via state manifest)
+    incremental: bool = False
+    # Skip uploading archives that are identical to existing objects, or copy them from the previous snapshot
+    skip_unchanged_uploads: bool = False
+    # Store each archive once under its content hash, with a manifest per snapshot that references them
+    content_addressed: bool = False
+    # Number of days to retain the snapshots for, when running garbage collection on the content addressed store
+    retention_days: PositiveInt = 30
+    # Directory to store the timings and the byte counts of each run, as JSON and as a Prometheus textfile
+    metrics_dir: pathlib.Path | None = None
+    # Filepath to store a timeline of every operation in the run, in the Chrome trace event format
+    trace_file: pathlib.Path | None = None
+    # Back up a single shard of the repos/gists as 'INDEX/COUNT' (eg: '3/8'), to split a backup across nodes
+    shard: str | None = Field(default=None, pattern=r"^[1-9][0-9]*/[1-9][0-9]*$")
 
     @classmethod
     def from_env_file(cls, filename: pathlib.Path) -> "EnvConfig":
@@ -148,6 +279,105 @@ class EnvConfig(BaseSettings):
         """Convert all git_ignore values to lowercase."""
         return [v.lower() for v in value]
 
+    @field_validator("git_owners", mode="before", check_fields=True)
+    def parse_git_owners(cls, value: List[str | dict]) -> List[dict]:
+        """Parse owners that are listed by name alone, without any overrides."""
+        if isinstance(value, list):
+            return [{"name": v} if isinstance(v, str) else v for v in value]
+        return value
+
+    @model_validator(mode="after")
+    def sharding(self) -> "EnvConfig":
+        """Validate the shard, and that all the shards share the snapshot prefix instead of a timestamp of their own."""
+        if not self.shard:
+            return self
+        index, count = map(int, self.shard.split("/"))
+        if index > count:
+            raise ValueError(f"Shard index must be between 1 and {count}, got {index}")
+        if "aws_s3_prefix" not in self.model_fields_set:
+            raise ValueError("'shard' requires 'aws_s3_prefix' to be set, so that all the shards share the snapshot")
+        return self
+
+    @model_validator(mode="after")
+    def owners(self) -> "EnvConfig":
+        """Validate that either a single owner or a list of owners is set, but not both."""
+        if bool(self.git_owner) == bool(self.git_owners):
+            raise ValueError("Either 'git_owner' or 'git_owners' must be set")
+        return self
+
+    def for_owner(self, owner: Owner) -> "EnvConfig":
+        """Get the configuration for a single owner of a multi-owner backup.
+
+        Args:
+            owner: Owner along with its overrides.
+
+        See Also:
+            - Each owner gets its own S3 prefix within the snapshot, so the archives and the manifests don't collide.
+            - The trace file is suffixed with the owner, since each owner records its own timeline.
+
+        Returns:
+            EnvConfig:
+            Returns a copy of the configuration, with the owner's overrides applied.
+        """
+        update = {
+            "git_owner": owner.name,
+            "git_owners": [],
+            "aws_s3_prefix": f"{self.aws_s3_prefix}/{owner.name}",
+        }
+        if owner.git_ignore is not None:
+            update["git_ignore"] = owner.git_ignore
+        if owner.cut_off_days is not None:
+            update["cut_off_days"] = owner.cut_off_days
+        if self.trace_file:
+            update["trace_file"] = self.trace_file.with_name(
+                f"{self.trace_file.stem}_{owner.name}{self.trace_file.suffix}"
+            )
+        return self.model_copy(update=update, deep=True)
+
+    @model_validator(mode="after")
+    def incremental_bundles(self) -> "EnvConfig":
+        """Enable incremental backups for incremental bundles, since the tips are tracked in the state manifest."""
+        if self.archive_format == ArchiveFormat.bundle_incremental:
+            self.incremental = True
+        return self
+
+    @model_validator(mode="after")
+    def unchanged_uploads(self) -> "EnvConfig":
+        """Validate that the archives can be compared against a previous snapshot, to skip unchanged uploads."""
+        if (
+            self.skip_unchanged_uploads
+            and not self.incremental
+            and not self.content_addressed
+            and "aws_s3_prefix" not in self.model_fields_set
+        ):
+            raise ValueError(
+                "'skip_unchanged_uploads' requires 'incremental' or 'aws_s3_prefix' to be set, "
+                "since the default prefix is a new timestamp for every run"
+            )
+        return self
+
+    @model_validator(mode="after")
+    def zstd_dependency(self) -> "EnvConfig":
+        """Validate that the optional dependency for zstd compression is installed."""
+        if self.archive_format == ArchiveFormat.tar_zst:
+            try:
+                import zstandard  # noqa: F401
+            except ImportError:
+                raise ValueError(
+                    f"{ArchiveFormat.tar_zst.value!r} archive format requires 'zstandard', "
+                    "install it with: pip install 'git2s3[zstd]'"
+                )
+        return self
+
+    @model_validator(mode="after")
+    def content_addressed_bundles(self) -> "EnvConfig":
+        """Validate that incremental bundles are not stored by content, since their chains span older snapshots."""
+        if self.content_addressed and self.archive_format == ArchiveFormat.bundle_incremental:
+            raise ValueError(
+                f"{ArchiveFormat.bundle_incremental.value!r} archive format is not supported with 'content_addressed'"
+            )
+        return self
+
     class Config:
         """Environment variables configuration."""
 
@@ -1,20 +1,35 @@
+import base64
+import contextlib
+import copy
+import itertools
 import json
 import logging
 import os
 import shutil
 import subprocess
-import threading
+import tempfile
 import warnings
 from collections.abc import Generator
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from datetime import datetime, timedelta, timezone
 from multiprocessing.pool import ThreadPool
-from typing import Dict
-from urllib.parse import urlsplit, urlunsplit
+from typing import Any, Dict, List, Tuple
+from urllib.parse import parse_qs, urlsplit
 
 import requests
-from pydantic import HttpUrl
 
-from git2s3 import config, exc, s3, squire
+from git2s3 import api, config, exc, metrics, pipeline, s3, squire, state
+
+# Number of bytes to retain from the end of stderr of a command, for diagnostics
+STDERR_LIMIT: int = 4096
+# Disk space reserved per byte of the listed size, for the clone with its working tree and the archive
+DISK_USAGE_FACTOR: int = 3
 
 
 class Git2S3:
@@ -26,24 +41,32 @@ class Git2S3:
     Keyword Args:
         env_file: Environment configuration.
         logger: Bring your own logger object.
-        max_per_page: Maximum number of repos to fetch per page.
+        resume: Boolean flag to resume an interrupted run from its journal.
+        env: Environment configuration to use instead of loading the ``env_file``
+        session: HTTP session to share with other backups, a new session is created when not set.
+        pool: Worker pools to share with other backups, new pools are created when not set.
+        s3_client: S3 client to share with other backups, a new client is created when not set.
+
+    See Also:
+        - Multiple owners are backed up with ``Scheduler``, which shares the session, the pools and the S3 client.
     """
 
     def __init__(
         self,
         env_file: str | os.PathLike = ".env",
         logger: logging.Logger = None,
+        resume: bool = False,
+        env: config.EnvConfig | None = None,
+        session: api.Session | None = None,
+        pool: pipeline.Pipeline | None = None,
+        s3_client: Any = None,
     ):
         """Instantiates Git2S3 object to clone all repos/wiki/gists from GitHub and upload to S3."""
-        self.env = squire.env_loader(env_file)
+        self.env = env or squire.env_loader(env_file)
+        if self.env.git_owners:
+            raise ValueError("Multiple owners are backed up with 'git2s3.Scheduler', set 'git_owner' instead.")
         self.logger = logger or squire.default_logger(self.env)
-        self.session = requests.Session()
-        self.session.headers = {
-            "Accept": "application/vnd.github+json",
-            "Authorization": f"Bearer {self.env.git_token}",
-            "X-GitHub-Api-Version": "2022-11-28",
-            "Content-Type": "application/x-www-form-urlencoded",
-        }
+        self.session = session or squire.github_session(self.env, self.logger)
         # Proceeding **will** most likely switch the origin URL and mess up the entire local stack
         # Make sure both the current working directory, and the backup directory (destination) is not a GIT repository
         if (".git" in os.listdir() and os.path.isdir(".git")) or (
@@ -52,11 +75,24 @@ class Git2S3:
             raise BaseException(
                 "ERROR: Cannot start backup process when the current directory is already a Git repository."
             )
-        self.cli("command -v git")  # Make sure git cli works
+        self.cli(["git", "--version"])  # Make sure git cli works
         self.clone_dir = os.path.join(self.env.backup_dir, self.env.git_owner)
+        if self.env.mirror_dir and os.path.commonpath(
+            [self.clone_dir, os.path.abspath(self.env.mirror_dir)]
+        ) == os.path.abspath(self.clone_dir):
+            raise ValueError("The mirror directory cannot be within the clone directory, as it is wiped on every run.")
         warnings.simplefilter("always", exc.DirectoryExists)
         warnings.simplefilter("always", exc.UnsupportedSource)
-        if os.path.isdir(self.clone_dir) and os.listdir(self.clone_dir):
+        self.resume = resume
+        self.journal = state.Journal(self.env, self.logger)
+        # archives of an interrupted run are reused when resuming
+        if self.resume and self.journal.load():
+            self.env.aws_s3_prefix = self.journal.snapshot
+            self.logger.info("Resuming the interrupted run for snapshot: %s", self.journal.snapshot)
+        elif self.resume:
+            self.logger.warning("No journal found to resume from, starting a new run.")
+            self.resume = False
+        if not self.resume and os.path.isdir(self.clone_dir) and os.listdir(self.clone_dir):
             warnings.warn(
                 "The clone directory is not empty. Deleting the contents to avoid conflicts.",
                 exc.DirectoryExists,
@@ -72,10 +108,21 @@ class Git2S3:
                 )
                 self.env.source.remove(config.SourceControl.gist)
         self.base_url = f"{self.env.git_api_url}/{profile}/{self.env.git_owner}"
-        metrics = {"fetched": 0, "clonable": 0, "success": 0, "failed": 0}
-        self.clones: Dict[config.SourceControl, Dict[str, int]] = {
-            src: metrics for src in self.env.source if src != config.SourceControl.wiki
-        }
+        self.graphql_url = squire.graphql_endpoint(self.env.git_api_url)
+        counters = {"fetched": 0, "clonable": 0, "unchanged": 0, "resumed": 0, "success": 0, "failed": 0}
+        # every source gets its own copy of the counters
+        self.clones: Dict[config.SourceControl, Dict[str, int]] = {src: dict(counters) for src in self.env.source}
+        if config.SourceControl.wiki in self.clones:
+            # 'has_wiki' flag will always be true even if there are no files to clone
+            self.clones[config.SourceControl.wiki]["missing"] = 0
+        self.manifest = state.Manifest(self.env, self.logger)
+        self.wiki_cache = state.WikiCache(self.env, self.logger)
+        # pools that are shared with other backups are shut down by their owner
+        self.shared = pool is not None
+        self.pipeline: pipeline.Pipeline | None = pool
+        self.s3_client = s3_client
+        self.uploader: s3.Uploader | None = None
+        self.metrics = metrics.Metrics(self.env, self.logger)
 
     def profile_type(self) -> str:
         """Get the profile type.
@@ -100,167 +147,629 @@ class Git2S3:
             f"Failed to get the profile type for {self.env.git_owner}. Please check the owner/organization name."
         )
 
-    def cli(self, cmd: str, fail: bool = True, retry: bool = False) -> int:
+    def run(
+        self, args: List[str], cwd: str | None = None, url: str | None = None, stdin: str | None = None
+    ) -> Tuple[int, str, str]:
+        """Runs a command directly without a shell, capturing the tail of its stderr.
+
+        Args:
+            args: Command to run, as a list of arguments.
+            cwd: Directory to run the command in.
+            url: Remote URL the command connects to, to authenticate with the token.
+            stdin: Text to send to the command's standard input.
+
+        See Also:
+            - stderr is spooled to a temporary file, so only the last few KB are held in memory.
+
+        Returns:
+            Tuple[int, str, str]:
+            Returns the return code, the standard output and the tail of the standard error.
+        """
+        with tempfile.TemporaryFile() as stderr:
+            process = subprocess.run(
+                args,
+                cwd=cwd,
+                env=self.git_env(url),
+                input=stdin,
+                stdout=subprocess.PIPE,
+                stderr=stderr,
+                text=True,
+            )
+            size = stderr.tell()
+            stderr.seek(max(size - STDERR_LIMIT, 0))
+            error = stderr.read().decode(errors="replace").strip()
+        return process.returncode, process.stdout, error.replace(self.env.git_token, "****")
+
+    def cli(
+        self,
+        args: List[str],
+        cwd: str | None = None,
+        fail: bool = True,
+        retry: bool = False,
+        url: str | None = None,
+    ) -> int:
         """Runs CLI commands.
 
         Args:
-            cmd: Command to run.
+            args: Command to run, as a list of arguments.
+            cwd: Directory to run the command in.
             fail: Boolean flag to fail on errors.
             retry: Boolean flag to indicate that it's a retry attempt.
+            url: Remote URL the command connects to, to authenticate with the token.
 
         Returns:
             int:
             Return code after running the command.
         """
-        redacted = cmd.replace(self.env.git_token, "****")
+        command = " ".join(args)
         try:
-            ret_code = subprocess.check_call(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT, shell=True)
-        except subprocess.CalledProcessError as error:
-            ret_code = error.returncode
-            if fail:
-                if error.output:
-                    self.logger.error(error.output)
-                else:
-                    self.logger.error("Failed to run %s", redacted)
+            ret_code, _, error = self.run(args, cwd, url)
+        except OSError as warning:
+            ret_code, error = 127, str(warning)
         if ret_code != 0:
+            if fail:
+                self.logger.error("Failed to run %r - %s", command, error or "no error output")
             if retry:
-                self.logger.warning("Retrying the command: %s", redacted)
-                return self.cli(cmd, fail, False)
+                self.logger.warning("Retrying the command: %s", command)
+                return self.cli(args, cwd, fail, False, url)
             if fail:
-                raise AssertionError(f"{redacted!r} - returned a non-zero exit code: {ret_code}")
+                raise AssertionError(f"{command!r} - returned a non-zero exit code: {ret_code}")
         return ret_code
 
+    def cli_output(
+        self, args: List[str], cwd: str | None = None, url: str | None = None, stdin: str | None = None
+    ) -> str | None:
+        """Runs CLI commands and captures the output.
+
+        Args:
+            args: Command to run, as a list of arguments.
+            cwd: Directory to run the command in.
+            url: Remote URL the command connects to, to authenticate with the token.
+            stdin: Text to send to the command's standard input.
+
+        Returns:
+            str:
+            Returns the stripped output of the command, or None if the command failed.
+        """
+        try:
+            ret_code, output, error = self.run(args, cwd, url, stdin)
+        except OSError as warning:
+            ret_code, output, error = 127, "", str(warning)
+        if ret_code == 0:
+            return output.strip()
+        self.logger.debug("%r - returned a non-zero exit code: %d - %s", " ".join(args), ret_code, error)
+
     def get_all(self, source: config.SourceControl) -> Generator[Dict[str, str]]:
         """Iterate through a target owner/organization to get all available repositories/gists.
 
         Args:
             source: Source type to clone.
 
+        See Also:
+            - With ``cut_off_days``, repos are sorted by the latest push and paging stops at the first stale page.
+            - Gists don't support sorting, so they are filtered with ``since`` instead.
+
         Yields:
             Generator[Dict[str, str]]:
             Yields a dictionary of each repo's information.
         """
+        if source == config.SourceControl.repo and self.env.graphql:
+            yield from self.get_all_graphql()
+            return
+        # only set for sorted listings, where the remaining pages are known to be stale after a stale page
+        cut_off = None
+        params = {}
         if source == config.SourceControl.repo:
             endpoint = f"{self.base_url}/repos"
+            if self.env.cut_off_days:
+                cut_off = self.env.cut_off_days
+                params = {"sort": "pushed", "direction": "desc"}
         elif source == config.SourceControl.gist:
             endpoint = f"{self.base_url}/gists"
+            if self.env.cut_off_days:
+                since = datetime.now(timezone.utc) - timedelta(days=self.env.cut_off_days)
+                params = {"since": since.strftime("%Y-%m-%dT%H:%M:%SZ")}
         else:
             # This won't occur programmatically, but here just in case
             raise exc.InvalidSource(
                 f"Invalid field type. Please choose from {config.SourceControl.repo!r} or {config.SourceControl.gist!r}"
             )
+        try:
+            response = self.get_page(endpoint, 1, params)
+        except (requests.RequestException, AssertionError) as error:
+            self.logger.error("Failed to fetch repos on page: %d - %s", 1, error)
+            raise exc.GitHubAPIError(f"Failed to fetch {source.value}s from {self.env.git_owner!r}.")
+        json_response = response.json()
+        self.logger.debug("Repositories in page %d: %d", 1, len(json_response))
+        # Yields dictionary from a list, so cloning starts while the rest of the pages are being fetched
+        yield from json_response
+        # A page that isn't full is the last one, which saves a round trip for an empty page
+        if len(json_response) < self.env.max_per_page:
+            return
+        if cut_off and squire.is_stale_page(json_response, cut_off):
+            self.logger.debug("Stopped listing at page %d, reason: no push in the last [%d days]", 1, cut_off)
+            return
+        last = response.links.get("last", {}).get("url")
+        if cut_off or not last:
+            # Without pagination links, pages are fetched one after the other until a page isn't full
+            # A sorted listing is fetched one page at a time as well, so the pages after a stale page are skipped
+            idx = 2
+            while len(json_response) == self.env.max_per_page:
+                try:
+                    json_response = self.get_page(endpoint, idx, params).json()
+                except (requests.RequestException, AssertionError) as error:
+                    self.logger.error("Failed to fetch repos on page: %d - %s", idx, error)
+                    raise exc.GitHubAPIError(f"Failed to fetch {source.value}s from {self.env.git_owner!r}.")
+                self.logger.debug("Repositories in page %d: %d", idx, len(json_response))
+                yield from json_response
+                if cut_off and squire.is_stale_page(json_response, cut_off):
+                    self.logger.debug("Stopped listing at page %d, reason: no push in the last [%d days]", idx, cut_off)
+                    return
+                idx += 1
+            return
+        total = int(parse_qs(urlsplit(last).query)["page"][0])
+        self.logger.debug("Fetching pages 2 to %d concurrently", total)
+        pages = iter(range(2, total + 1))
+        futures = {}
+        with ThreadPoolExecutor(max_workers=self.env.api_workers) as executor:
+            try:
+                while True:
+                    # Only a page per worker is fetched ahead, so the responses held don't grow with the owner
+                    for idx in itertools.islice(pages, self.env.api_workers - len(futures)):
+                        futures[executor.submit(self.get_page, endpoint, idx, params)] = idx
+                    if not futures:
+                        return
+                    # Pages are yielded as they arrive, instead of waiting for the ones before them
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        idx = futures.pop(future)
+                        try:
+                            json_response = future.result().json()
+                        except (requests.RequestException, AssertionError) as error:
+                            # requests are retried by the session, so a failure here means the listing is incomplete
+                            self.logger.error("Failed to fetch repos on page: %d - %s", idx, error)
+                            raise exc.GitHubAPIError(f"Failed to fetch {source.value}s from {self.env.git_owner!r}.")
+                        self.logger.debug("Repositories in page %d: %d", idx, len(json_response))
+                        yield from json_response
+            finally:
+                # Don't fetch the remaining pages when the caller stops iterating
+                for future in futures:
+                    future.cancel()
+
+    def get_all_graphql(self) -> Generator[Dict[str, str]]:
+        """Iterate through a target owner/organization to get all available repositories using the GraphQL API.
+
+        See Also:
+            - Only the fields that are required for the backup are fetched, instead of the entire REST payload.
+            - GraphQL uses cursor based pagination, so the pages are fetched one after the other.
+            - With ``cut_off_days``, repos are sorted by the latest push and paging stops at the first stale page.
+
+        Yields:
+            Generator[Dict[str, str]]:
+            Yields a dictionary of each repo's information, in the same shape as the REST API.
+        """
+        cursor = None
         idx = 1
+        order = {"field": "PUSHED_AT", "direction": "DESC"} if self.env.cut_off_days else None
         while True:
             self.logger.debug("Fetching repos from page %d", idx)
             try:
-                response = self.session.get(
-                    url=endpoint,
-                    params={"per_page": self.env.max_per_page, "page": idx},
+                response, timing = metrics.timed(
+                    self.session.post,
+                    url=self.graphql_url,
+                    headers={"Content-Type": "application/json"},
+                    json={
+                        "query": squire.GRAPHQL_REPOSITORIES,
+                        "variables": {
+                            "owner": self.env.git_owner,
+                            "first": self.env.max_per_page,
+                            "after": cursor,
+                            "orderBy": order,
+                        },
+                    },
                 )
                 assert response.ok, response.text
-            except (requests.RequestException, AssertionError) as error:
+                json_response = response.json()
+                # GraphQL responds with 200 OK along with the errors
+                assert not json_response.get("errors"), json_response.get("errors")
+                repositories = json_response["data"]["repositoryOwner"]["repositories"]
+            except (requests.RequestException, AssertionError, KeyError, TypeError) as error:
                 self.logger.error("Failed to fetch repos on page: %d - %s", idx, error)
-                if idx == 1:
-                    raise exc.GitHubAPIError(f"Failed to fetch {source.value}s from {self.env.git_owner!r}.")
-                break
-            json_response = response.json()
-            if json_response:
-                self.logger.debug("Repositories in page %d: %d", idx, len(json_response))
-                # Yields dictionary from a list
-                yield from json_response
-                idx += 1
-            else:
-                self.logger.debug("No repos found in page: %d, ending loop.", idx)
-                break
+                raise exc.GitHubAPIError(f"Failed to fetch repos from {self.env.git_owner!r}.")
+            self.metrics.record("listing", f"graphql/{idx}", timing, len(response.content))
+            self.logger.debug("Repositories in page %d: %d", idx, len(repositories["nodes"]))
+            page = [squire.graphql_repository(node) for node in repositories["nodes"]]
+            yield from page
+            if not repositories["pageInfo"]["hasNextPage"]:
+                return
+            if order and squire.is_stale_page(page, self.env.cut_off_days):
+                self.logger.debug(
+                    "Stopped listing at page %d, reason: no push in the last [%d days]", idx, self.env.cut_off_days
+                )
+                return
+            cursor = repositories["pageInfo"]["endCursor"]
+            idx += 1
 
-    def set_pat(self, url: str | HttpUrl) -> str | HttpUrl | None:
-        """Creates an authenticated URL by updating the netloc, and sets that as the origin URL.
+    def get_page(self, endpoint: str, idx: int, params: Dict[str, str] | None = None) -> requests.Response:
+        """Fetches a single page of repositories/gists.
 
         Args:
-            url: Takes the repository/gist/wiki URL as input.
+            endpoint: API endpoint to fetch from.
+            idx: Page number.
+            params: Additional query parameters, like the sort order.
+
+        Returns:
+            requests.Response:
+            Returns the response object for the page.
+        """
+        self.logger.debug("Fetching repos from page %d", idx)
+        response, timing = metrics.timed(
+            self.session.get,
+            url=endpoint,
+            params={**(params or {}), "per_page": self.env.max_per_page, "page": idx},
+        )
+        assert response.ok, response.text
+        # includes the time spent waiting for the rate limit, which is part of the cost of listing
+        self.metrics.record("listing", f"{endpoint}/{idx}", timing, len(response.content))
+        return response
+
+    def git_env(self, url: str | None = None) -> Dict[str, str]:
+        """Get the environment variables for git commands, with the token as an HTTP header for the remote.
+
+        Args:
+            url: Remote URL the command connects to.
 
         See Also:
-            - This step is not required for:
-                - Public repositories/gists/wiki
-                -
+            - The token is never part of the command line or the URL, so it doesn't leak into process listings,
+              error messages or the ``origin`` of the cloned repositories.
+            - The header is scoped to the remote's host, so it isn't sent anywhere else.
+            - Credential prompts are disabled, so a missing repository fails instead of waiting for input.
+
+        Returns:
+            Dict[str, str]:
+            Returns the environment variables.
         """
-        url_split = urlsplit(str(url))
-        authed_netloc = f"{self.env.git_token}@{url_split.netloc}"
-        joined = urlunsplit(
-            (
-                url_split.scheme,
-                authed_netloc,
-                url_split.path,
-                url_split.query,
-                url_split.fragment,
+        env = {**os.environ, "GIT_TERMINAL_PROMPT": "0"}
+        if url and self.env.git_token:
+            url_split = urlsplit(str(url))
+            credentials = base64.b64encode(f"x-access-token:{self.env.git_token}".encode()).decode()
+            env.update(
+                GIT_CONFIG_COUNT="1",
+                GIT_CONFIG_KEY_0=f"http.{url_split.scheme}://{url_split.netloc}/.extraHeader",
+                GIT_CONFIG_VALUE_0=f"Authorization: Basic {credentials}",
             )
-        )
-        return joined
+        return env
 
-    def clone_wiki(self, datastore: config.DataStore) -> None:
-        """Clone all the wikis from the repository.
+    def git_clone(
+        self,
+        url: str,
+        destination: str,
+        source: config.SourceControl,
+        bare: bool = False,
+        fail: bool = True,
+        retry: bool = False,
+    ) -> int:
+        """Clones a repository/gist/wiki into the destination, through the local mirror cache when enabled.
 
         Args:
-            datastore: DataStore model to store repository/gist information.
+            url: Clone URL, the token is passed to git as an HTTP header.
+            destination: Directory to clone into.
+            source: Source type of the URL.
+            bare: Boolean flag to create a bare mirror clone as the destination itself.
+            fail: Boolean flag to fail on errors.
+            retry: Boolean flag to retry once on errors.
+
+        See Also:
+            - Mirrors are bare repositories stored at ``<mirror_dir>/<owner>/<source>/<name>.git``
+            - Existing mirrors are updated with ``git fetch --prune``, so only new objects cross the network.
+            - The working copy is then cloned from the mirror, which uses hardlinks instead of copying objects.
+
+        Returns:
+            int:
+            Return code after running the command.
         """
-        datastore.source = config.SourceControl.wiki
-        self.logger.debug("Cloning wiki for %s", datastore.name)
-        wiki_url = str(datastore.clone_url).replace(".git", ".wiki.git")
-        if datastore.private:
-            destination = str(
-                os.path.join(
-                    self.clone_dir,
-                    datastore.source.value,
-                    "private",
-                    f"{datastore.name}.wiki",
+        if not self.env.mirror_dir:
+            if bare:
+                return self.cli(
+                    ["git", "clone", "--mirror", "--quiet", url, destination], fail=fail, retry=retry, url=url
                 )
+            return self.cli(["git", "clone", "--quiet", url], cwd=destination, fail=fail, retry=retry, url=url)
+        repository = squire.clone_name(url)
+        mirror = os.path.join(self.env.mirror_dir, self.env.git_owner, source.value, f"{repository}.git")
+        if os.path.isdir(mirror):
+            self.logger.debug("Updating mirror: [%s]", mirror)
+            ret_code = self.cli(
+                ["git", "fetch", "--prune", "--quiet", url, "+refs/*:refs/*"],
+                cwd=mirror,
+                fail=fail,
+                retry=retry,
+                url=url,
             )
         else:
-            destination = str(
-                os.path.join(
-                    self.clone_dir,
-                    datastore.source.value,
-                    "public",
-                    f"{datastore.name}.wiki",
+            self.logger.debug("Creating mirror: [%s]", mirror)
+            os.makedirs(os.path.dirname(mirror), exist_ok=True)
+            ret_code = self.cli(["git", "clone", "--mirror", "--quiet", url, mirror], fail=fail, retry=retry, url=url)
+            if ret_code != 0 and os.path.isdir(mirror):
+                shutil.rmtree(mirror)
+        if ret_code != 0:
+            return ret_code
+        if bare:
+            ret_code = self.cli(["git", "clone", "--mirror", "--quiet", mirror, destination], fail=fail)
+            repository = ""
+        else:
+            ret_code = self.cli(["git", "clone", "--quiet", mirror, repository], cwd=destination, fail=fail)
+        if ret_code == 0:
+            # point the clone back to the actual remote instead of the local mirror
+            self.cli(["git", "remote", "set-url", "origin", url], cwd=os.path.join(destination, repository))
+        return ret_code
+
+    def bundle(self, destination: str, previous: Dict[str, Any] | None = None) -> Tuple[Dict[str, str], bool]:
+        """Creates a git bundle with all the branches and tags of a bare clone, and deletes the clone.
+
+        Args:
+            destination: Bare repository to be bundled.
+            previous: Previous manifest entry, to only bundle the commits added since its recorded tips.
+
+        See Also:
+            - Incremental bundles have to be applied on top of the previous bundles in the chain to restore.
+            - No bundle is created when there are no new commits, only the tips are updated in the manifest.
+
+        Returns:
+            Tuple[Dict[str, str], bool]:
+            Returns the tips of all the branches and tags, and a flag to indicate if a bundle was created.
+        """
+        refs = {}
+        if output := self.cli_output(
+            ["git", "for-each-ref", "--format=%(objectname) %(refname)", "refs/heads", "refs/tags"], cwd=destination
+        ):
+            for line in output.splitlines():
+                sha, ref = line.split(maxsplit=1)
+                refs[ref] = sha
+        exclude = []
+        if refs and previous and previous.get("refs"):
+            tips = "\n".join(sorted(set(previous["refs"].values())))
+            # tips that were force pushed away and garbage collected can't be excluded
+            if output := self.cli_output(["git", "cat-file", "--batch-check"], cwd=destination, stdin=f"{tips}\n"):
+                exclude = [line.split()[0] for line in output.splitlines() if not line.endswith("missing")]
+        revs = ["--branches", "--tags"]
+        if exclude:
+            revs += ["--not"] + exclude
+        # refs that were added or moved onto commits of the previous bundles leave nothing new to bundle
+        if not refs or (exclude and self.cli_output(["git", "rev-list", "--count"] + revs, cwd=destination) == "0"):
+            shutil.rmtree(destination)
+            return refs, False
+        self.cli(["git", "bundle", "create", "--quiet", f"{destination}.bundle"] + revs, cwd=destination)
+        shutil.rmtree(destination)
+        return refs, True
+
+    def clone_wiki(self, datastore: config.DataStore, reservation: pipeline.Reservation | None = None) -> str:
+        """Clone all the wikis from the repository.
+
+        Args:
+            datastore: DataStore record of the repository/gist information.
+            reservation: Disk space reserved for the wiki, released once it's done.
+
+        Returns:
+            str:
+            Returns the metrics key for the outcome, one of ``success``, ``unchanged``, ``resumed`` or ``missing``.
+        """
+        datastore.source = config.SourceControl.wiki
+        key = squire.manifest_key(datastore)
+        with self.metrics.span("clone_wiki", key=key), contextlib.ExitStack() as stack:
+            if reservation:
+                stack.callback(reservation.release)
+            self.logger.debug("Cloning wiki for %s", datastore.name)
+            wiki_url = str(datastore.clone_url).replace(".git", ".wiki.git")
+            if datastore.private:
+                destination = str(
+                    os.path.join(
+                        self.clone_dir,
+                        datastore.source.value,
+                        "private",
+                        f"{datastore.name}.wiki",
+                    )
                 )
+            else:
+                destination = str(
+                    os.path.join(
+                        self.clone_dir,
+                        datastore.source.value,
+                        "public",
+                        f"{datastore.name}.wiki",
+                    )
+                )
+            if self.wiki_cache.is_missing(key):
+                self.logger.debug("Skipping wiki: '%s', reason: known to be missing", datastore.name)
+                return "missing"
+            if self.resume and self.resumed(datastore, destination):
+                return "resumed"
+            # probing is a single request, compared to a clone attempt along with creating and deleting the destination
+            try:
+                ret_code, remote, error = self.run(["git", "ls-remote", wiki_url, "HEAD"], url=wiki_url)
+            except OSError as warning:
+                ret_code, remote, error = 127, "", str(warning)
+            # only a wiki that doesn't exist or has no pages is cached, so a failed probe is retried on the next run
+            if (ret_code == 0 and not remote.strip()) or (ret_code != 0 and squire.repository_missing(error)):
+                self.logger.debug("Skipping wiki: '%s', reason: not found", datastore.name)
+                self.wiki_cache.add(key)
+                return "missing"
+            if ret_code != 0:
+                self.logger.error("Failed to probe the wiki for %s - %s", datastore.name, error or "no error output")
+                raise AssertionError(f"Failed to probe the wiki for {datastore.name!r} - exit code: {ret_code}")
+            # wikis don't have a timestamp in the API response, so compare the remote HEAD instead
+            head = remote.split()[0]
+            if self.env.incremental and self.manifest.unchanged(key, head=head):
+                self.logger.info("Skipping wiki: '%s', reason: unchanged since the last backup", datastore.name)
+                self.manifest.carry_forward(key)
+                return "unchanged"
+            os.makedirs(destination, exist_ok=True)
+            bare = squire.archive_extension(self.env.archive_format) == "bundle"
+            # The wiki is known to exist at this point, so a failed clone is an actual failure
+            _, timing = self.pipeline.clone.run(
+                metrics.timed, self.git_clone, wiki_url, destination, datastore.source, bare=bare, retry=True
             )
-        os.makedirs(destination, exist_ok=True)
-        wiki_url = self.set_pat(wiki_url)
-        # Skip if cloning failed, as wiki pages are not guaranteed to exist
-        output = self.cli(f"cd {destination} && git clone {wiki_url}", fail=False)
-        if output == 0:
+            size = squire.directory_size(destination)
+            self.metrics.record("clone", key, timing, size)
+            if reservation:
+                # wikis are not listed with a size, so they are accounted for once cloned
+                reservation.update(size * (DISK_USAGE_FACTOR - 1))
+            self.journal.write("cloned", key=key)
+            if (self.env.skip_unchanged_uploads or self.env.content_addressed) and not bare:
+                self.normalize(os.path.join(destination, squire.clone_name(wiki_url)))
+            self.ship(datastore, destination, head=head)
+            return "success"
+
+    def ship(
+        self,
+        datastore: config.DataStore,
+        destination: str,
+        updated_at: str | None = None,
+        head: str | None = None,
+    ) -> None:
+        """Archives a cloned directory, and uploads the archive right away when pipelining is enabled.
+
+        Args:
+            datastore: DataStore record of the repository/gist information.
+            destination: Directory to be archived.
+            updated_at: Latest ``pushed_at``/``updated_at`` timestamp from the API.
+            head: HEAD SHA of the clone.
+
+        Raises:
+            ArchiveError:
+            If the thread fails to archive the directory.
+            UploadError:
+            If the thread fails to upload the archive.
+        """
+        key = squire.manifest_key(datastore)
+        extension = squire.archive_extension(self.env.archive_format)
+        archive = f"{destination}.{extension}"
+        s3_file_path = f"{self.env.aws_s3_prefix}/{key}.{extension}"
+        extra = {}
+        if extension == "bundle":
+            previous = None
+            if self.env.archive_format == config.ArchiveFormat.bundle_incremental:
+                previous = self.manifest.previous.get(key)
             try:
-                squire.archer(destination)
+                (refs, created), timing = self.pipeline.archive.run(metrics.timed, self.bundle, destination, previous)
             except AssertionError:
-                self.logger.error("Failed to create a zip file for %s", datastore.name)
-                raise exc.ArchiveError(f"Failed to create a zip file for {datastore.name!r}")
-        else:
+                self.logger.error("Failed to create a bundle for %s", datastore.name)
+                raise exc.ArchiveError(f"Failed to create a bundle for {datastore.name!r}")
+            if not refs:
+                self.logger.warning("Skipping %s: '%s', reason: no branches or tags", datastore.source, datastore.name)
+                return
+            extra["refs"] = refs
+            chain = previous.get("chain", []) if previous and previous.get("refs") else []
+            if created:
+                extra["chain"] = chain + [s3_file_path]
+                self.metrics.record("archive", key, timing, os.path.getsize(archive))
+            else:
+                self.logger.info("No new commits in %s: '%s' since the last bundle", datastore.source, datastore.name)
+                self.manifest.carry_forward(key, updated_at=updated_at, head=head, refs=refs, chain=chain)
+                return
+        elif (
+            self.env.stream_archive
+            and self.env.pipeline
+            and self.uploader
+            and not self.env.local_store
+            and not self.env.content_addressed
+        ):
+            # compression happens while uploading, so the archive never touches the disk
+            self.journal.write(
+                "archived", key=key, object=s3_file_path, record={"updated_at": updated_at, "head": head}
+            )
+            self.pipeline.upload.run(self.uploader.stream_archive, destination, s3_file_path)
             shutil.rmtree(destination)
+            if self.env.incremental:
+                self.manifest.record(key, s3_file_path, updated_at, head)
+            return
+        else:
+            try:
+                _, timing = self.pipeline.archive.run(
+                    metrics.timed,
+                    squire.archer,
+                    destination,
+                    self.env.archive_format,
+                    self.env.compression_level,
+                    self.env.compression_threads,
+                )
+            except AssertionError:
+                self.logger.error("Failed to create a %s file for %s", extension, datastore.name)
+                raise exc.ArchiveError(f"Failed to create a {extension} file for {datastore.name!r}")
+            self.metrics.record("archive", key, timing, os.path.getsize(archive))
+        self.journal.write(
+            "archived", key=key, object=s3_file_path, record={"updated_at": updated_at, "head": head, **extra}
+        )
+        if self.env.pipeline and self.uploader:
+            self.pipeline.upload.run(self.uploader.upload_file, archive, s3_file_path)
+            if not self.env.local_store:
+                os.remove(archive)
+        if self.env.incremental:
+            self.manifest.record(key, s3_file_path, updated_at, head, **extra)
 
-    def worker(self, source: Dict[str, str]) -> None:
-        """Clones repository/gist/wiki from GitHub.
+    def resumed(self, datastore: config.DataStore, destination: str) -> bool:
+        """Picks up an entry from the journal of an interrupted run, if it was archived or uploaded.
 
         Args:
-            source: Repository/Gist information as JSON payload.
+            datastore: DataStore record of the repository/gist information.
+            destination: Directory the entry is cloned into.
 
-        Raises:
-            Exception:
-            If the thread fails to clone the repository.
+        See Also:
+            - Uploaded objects are reused as-is, and archives that are still on disk are uploaded.
+            - Anything else is cloned again, after removing the partial clone of the interrupted run.
+
+        Returns:
+            bool:
+            Returns a boolean flag to indicate if the entry was picked up from the journal.
         """
-        datastore = squire.source_detector(source, self.env)
-        self.logger.info("Cloning %s: %s", datastore.source, datastore.name)
-        if datastore.private:
-            destination = str(os.path.join(self.clone_dir, datastore.source.value, "private", datastore.name))
+        key = squire.manifest_key(datastore)
+        extension = squire.archive_extension(self.env.archive_format)
+        archive = f"{destination}.{extension}"
+        s3_file_path = f"{self.env.aws_s3_prefix}/{key}.{extension}"
+        entry = self.journal.archived.get(s3_file_path)
+        uploaded = self.journal.uploaded.get(s3_file_path)
+        if entry and uploaded and self.uploader:
+            self.logger.info("Resuming %s: '%s', reason: uploaded before the interruption", datastore.source, key)
+            with self.uploader.lock:
+                self.uploader.uploaded.add(s3_file_path)
+            if self.uploader.store and uploaded.get("blob"):
+                self.uploader.store.blobs[s3_file_path] = uploaded["blob"]
+        elif entry and os.path.isfile(archive):
+            self.logger.info("Resuming %s: '%s', reason: archived before the interruption", datastore.source, key)
+            if self.env.pipeline and self.uploader:
+                self.pipeline.upload.run(self.uploader.upload_file, archive, s3_file_path)
+                if not self.env.local_store:
+                    os.remove(archive)
         else:
-            destination = str(os.path.join(self.clone_dir, datastore.source.value, "public", datastore.name))
-        # only repos have this field anyway
-        if config.SourceControl.wiki in self.env.source and source.get("has_wiki"):
-            # run as daemon and don't care about the output for wiki
-            # 'has_wiki' flag will always be true even if there are no files to clone
-            threading.Thread(target=self.clone_wiki, args=(datastore,), daemon=True).start()
+            if os.path.isdir(destination):
+                shutil.rmtree(destination)
+            return False
+        if self.env.incremental:
+            self.manifest.record(key, s3_file_path, **entry["record"])
+        return True
+
+    def checkout(self, datastore: config.DataStore, destination: str) -> str | None:
+        """Clones repository/gist from GitHub into the destination.
+
+        Args:
+            datastore: DataStore record of the repository/gist information.
+            destination: Directory to clone into.
+
+        Returns:
+            str:
+            Returns the HEAD SHA of the clone when incremental backups are enabled.
+        """
         os.makedirs(destination, exist_ok=True)
-        datastore.clone_url = self.set_pat(datastore.clone_url)
-        self.cli(f"cd {destination} && git clone {datastore.clone_url}", retry=True)
+        # bundles are created from a bare mirror, which holds all the branches and tags without a working tree
+        bare = squire.archive_extension(self.env.archive_format) == "bundle"
+        self.git_clone(str(datastore.clone_url), destination, datastore.source, bare=bare, retry=True)
+        head = None
+        if self.env.incremental:
+            repository = destination if bare else os.path.join(destination, squire.clone_name(datastore.clone_url))
+            head = self.cli_output(["git", "rev-parse", "HEAD"], cwd=repository)
+        if bare:
+            return head
+        if self.env.skip_unchanged_uploads or self.env.content_addressed:
+            self.normalize(os.path.join(destination, squire.clone_name(datastore.clone_url)))
         try:
             if datastore.description:
                 desc_file = os.path.join(destination, "description_git2s3.txt")
@@ -270,11 +779,84 @@ class Git2S3:
         except Exception as warning:
             # Adding description file is only an added feature, so no need to fail
             self.logger.warning(warning)
-        try:
-            squire.archer(destination)
-        except AssertionError:
-            self.logger.error("Failed to create a zip file for %s", datastore.name)
-            raise exc.ArchiveError(f"Failed to create a zip file for {datastore.name!r}")
+        return head
+
+    def normalize(self, repository: str) -> None:
+        """Removes the local state of a fresh clone, so archiving the same commit results in the same archive.
+
+        Args:
+            repository: Path of the cloned repository.
+
+        See Also:
+            - The index is rebuilt without the file stats, which ``git status`` refreshes on its first run.
+            - Reflogs of a fresh clone only hold the timestamp of the clone.
+        """
+        self.cli(["git", "read-tree", "HEAD"], cwd=repository, fail=False)
+        shutil.rmtree(os.path.join(repository, ".git", "logs"), ignore_errors=True)
+
+    def worker(self, datastore: config.DataStore, reservation: pipeline.Reservation | None = None) -> str:
+        """Clones repository/gist/wiki from GitHub.
+
+        Args:
+            datastore: DataStore record of the repository/gist information.
+            reservation: Disk space reserved for the repository/gist, released once it's done.
+
+        Raises:
+            Exception:
+            If the thread fails to clone the repository.
+
+        Returns:
+            str:
+            Returns the metrics key for the outcome, either ``success`` or ``resumed``
+        """
+        self.logger.info("Cloning %s: %s", datastore.source, datastore.name)
+        if datastore.private:
+            destination = str(os.path.join(self.clone_dir, datastore.source.value, "private", datastore.name))
+        else:
+            destination = str(os.path.join(self.clone_dir, datastore.source.value, "public", datastore.name))
+        with self.metrics.span("worker", key=squire.manifest_key(datastore)), contextlib.ExitStack() as stack:
+            if reservation:
+                stack.callback(reservation.release)
+            if self.resume and self.resumed(datastore, destination):
+                return "resumed"
+            head, timing = self.pipeline.clone.run(metrics.timed, self.checkout, datastore, destination)
+            key = squire.manifest_key(datastore)
+            size = squire.directory_size(destination)
+            self.metrics.record("clone", key, timing, size)
+            if reservation:
+                # the estimate is replaced with the clone, along with room for an archive of the same size
+                reservation.update(size * (DISK_USAGE_FACTOR - 1))
+            self.journal.write("cloned", key=key)
+            self.ship(datastore, destination, datastore.updated_at, head)
+            return "success"
+
+    def collect(self, futures: Dict[Future, Tuple[config.SourceControl, str]], wait: bool = False) -> bool:
+        """Counts the outcome of the jobs that completed, and drops them so only the pending jobs are held.
+
+        Args:
+            futures: Jobs mapped to the source type and the name of the repository/gist/wiki.
+            wait: Boolean flag to wait for all the jobs to complete.
+
+        Returns:
+            bool:
+            Returns a boolean flag to indicate if all the completed jobs were successful.
+        """
+        success = True
+        completed = as_completed(futures) if wait else [future for future in futures if future.done()]
+        for future in completed:
+            source, identifier = futures.pop(future)
+            if future.exception():
+                self.clones[source]["failed"] += 1
+                self.logger.error(
+                    "Thread cloning the %s '%s' received an exception: %s",
+                    source,
+                    identifier,
+                    future.exception(),
+                )
+                success = False
+            else:
+                self.clones[source][future.result()] += 1
+        return success
 
     def cloner(self, source: config.SourceControl) -> bool:
         """Clones all the repos/gists concurrently.
@@ -283,9 +865,13 @@ class Git2S3:
             source: Source type to clone.
 
         See Also:
-            - Clones all the repos/gists concurrently using ThreadPoolExecutor.
+            - Clones all the repos/gists concurrently using the pipeline's bounded worker pools.
             - GitHub doesn't have a rate limit for cloning, so multi-threading is safe.
             - This makes it depend on Git installed on the host machine.
+            - When ``largest_first`` is enabled, the entire listing is ordered by size before anything is cloned.
+            - When ``disk_budget`` is set, each repo/gist waits for its estimated disk space before it's submitted.
+            - Completed jobs are counted as the listing proceeds, so memory doesn't grow with the size of the org.
+            - When ``shard`` is set, only the repos/gists that hash into the shard are cloned.
 
         References:
             https://github.com/orgs/community/discussions/44515
@@ -294,52 +880,140 @@ class Git2S3:
             bool:
             Returns a boolean flag to indicate if any of the threads failed.
         """
-        futures = {}
-        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
-            for src in self.get_all(source):
-                identifier = src.get("name") or src.get("id")
-                self.clones[source]["fetched"] += 1
-                if identifier.lower() in self.env.git_ignore:
-                    self.logger.info("Skipping %s: '%s', reason: git_ignore", source, identifier)
-                    continue
-                # pushed_at - works only for repos
-                # updated_at - works for both repos and gists but includes updates like PRs, issues, metadata etc
-                last_updated = src.get("pushed_at") or src.get("updated_at")
-                if last_updated:
-                    if self.env.cut_off_days and squire.is_older_than_n_days(
-                        timestamp_str=last_updated,
-                        n_days=self.env.cut_off_days,
-                    ):
-                        self.logger.info(
-                            "Skipping %s: '%s', reason: no push/update in the last [%d days]",
-                            source.value,
-                            identifier,
-                            self.env.cut_off_days,
+        with self.metrics.span("cloner", source=source.value):
+            futures: Dict[Future, Tuple[config.SourceControl, str]] = {}
+            listed = True
+            success = True
+            # each page is reduced to compact records as it arrives, so the raw API responses are released
+            sources = (squire.source_detector(src, self.env) for src in self.get_all(source))
+            if self.env.largest_first:
+                # the largest repos/gists are started first, so they don't end up as the last ones running
+                collected = []
+                try:
+                    collected.extend(sources)
+                except exc.GitHubAPIError as error:
+                    self.logger.error("Listing %ss was incomplete: %s", source.value, error)
+                    listed = False
+                sources = sorted(collected, key=lambda record: record.size, reverse=True)
+            try:
+                for datastore in sources:
+                    identifier = datastore.name
+                    self.clones[source]["fetched"] += 1
+                    if identifier.lower() in self.env.git_ignore:
+                        self.logger.info("Skipping %s: '%s', reason: git_ignore", source, identifier)
+                        continue
+                    # wikis are submitted along with their repos, so they belong to the same shard
+                    if self.env.shard and not squire.in_shard(f"{source.value}/{identifier}", self.env.shard):
+                        self.logger.debug(
+                            "Skipping %s: '%s', reason: not in shard %s", source, identifier, self.env.shard
                         )
                         continue
-                else:
-                    self.logger.warning("Failed to get last update timestamp for: %s", identifier)
-                self.logger.info("Cloning %s: '%s'", source.value, identifier)
-                self.clones[source]["clonable"] += 1
-                future = executor.submit(self.worker, src)
-                futures[future] = identifier
-        exception = True
-        for future in as_completed(futures):
-            if future.exception():
-                self.clones[source]["failed"] += 1
-                self.logger.error(
-                    "Thread cloning the %s '%s' received an exception: %s",
-                    source,
-                    futures[future],
-                    future.exception(),
-                )
-                exception = False
-            else:
-                self.clones[source]["success"] += 1
-        return exception
+                    if datastore.updated_at:
+                        if self.env.cut_off_days and squire.is_older_than_n_days(
+                            timestamp_str=datastore.updated_at,
+                            n_days=self.env.cut_off_days,
+                        ):
+                            self.logger.info(
+                                "Skipping %s: '%s', reason: no push/update in the last [%d days]",
+                                source.value,
+                                identifier,
+                                self.env.cut_off_days,
+                            )
+                            continue
+                    else:
+                        self.logger.warning("Failed to get last update timestamp for: %s", identifier)
+                    # only repos have this field anyway
+                    if config.SourceControl.wiki in self.env.source and datastore.has_wiki:
+                        # wikis are cloned independent of the repo, but share the same bounded pipeline
+                        self.clones[config.SourceControl.wiki]["fetched"] += 1
+                        self.clones[config.SourceControl.wiki]["clonable"] += 1
+                        wiki_future = self.pipeline.jobs.submit(
+                            self.clone_wiki,
+                            copy.copy(datastore),
+                            self.pipeline.budget.reserve(0) if self.pipeline.budget else None,
+                        )
+                        futures[wiki_future] = (config.SourceControl.wiki, identifier)
+                    if self.env.incremental:
+                        key = squire.manifest_key(datastore)
+                        # GraphQL listing provides the HEAD of the default branch, so it's compared without cloning
+                        if self.manifest.unchanged(key, updated_at=datastore.updated_at, head=datastore.head):
+                            self.logger.info(
+                                "Skipping %s: '%s', reason: unchanged since the last backup",
+                                source.value,
+                                identifier,
+                            )
+                            self.manifest.carry_forward(key)
+                            self.clones[source]["unchanged"] += 1
+                            continue
+                    self.logger.info("Cloning %s: '%s'", source.value, identifier)
+                    self.clones[source]["clonable"] += 1
+                    reservation = None
+                    if self.pipeline.budget:
+                        # Blocks while the repos/gists in flight hold the disk budget
+                        reservation = self.pipeline.budget.reserve(datastore.size * DISK_USAGE_FACTOR)
+                    # Blocks while the pipeline is at capacity, so listing doesn't run too far ahead of cloning
+                    future = self.pipeline.jobs.submit(self.worker, datastore, reservation)
+                    self.journal.write("listed", key=squire.manifest_key(datastore))
+                    futures[future] = (source, identifier)
+                    success = self.collect(futures) and success
+            except exc.GitHubAPIError as error:
+                # the jobs that were already submitted are still awaited, but the run is marked as failed
+                self.logger.error("Listing %ss was incomplete: %s", source.value, error)
+                listed = False
+            # wikis are awaited as well, so that they are included in the upload
+            return self.collect(futures, wait=True) and success and listed
+
+    def snapshots(self) -> List[str]:
+        """Get the snapshot prefixes that hold the archives in the previous state manifest.
+
+        Returns:
+            List[str]:
+            Returns the list of snapshot prefixes.
+        """
+        return sorted({entry["snapshot"] for entry in self.manifest.previous.values() if entry.get("snapshot")})
+
+    def snapshot_objects(self, payload: Dict[str, Any] | None = None) -> Dict[str, str]:
+        """Get the archives of the current snapshot mapped to their blobs, in the content addressed store.
+
+        Args:
+            payload: State manifest payload, to include the archives that were carried forward.
+
+        Returns:
+            Dict[str, str]:
+            Returns the archive paths relative to the snapshot prefix, mapped to their blobs.
+        """
+        objects = {
+            key.removeprefix(f"{self.env.aws_s3_prefix}/"): blob
+            for key, blob in self.uploader.store.blobs.items()
+            if key in self.uploader.uploaded
+        }
+        for entry in (payload or {}).get("entries", {}).values():
+            if entry.get("blob"):
+                objects.setdefault(entry["object"].removeprefix(f"{entry['snapshot']}/"), entry["blob"])
+        return objects
+
+    def report(self) -> None:
+        """Logs the summary of the metrics, and stores the report and the trace when they are enabled."""
+        report = self.metrics.report(self.clones)
+        self.metrics.summarize(report)
+        if self.env.metrics_dir:
+            try:
+                self.metrics.export(report)
+            except OSError as error:
+                # metrics are not worth failing the backup for
+                self.logger.warning("Failed to store the metrics - %s", error)
+        if self.env.trace_file:
+            try:
+                self.metrics.save_trace()
+            except OSError as error:
+                self.logger.warning("Failed to store the trace - %s", error)
 
     def start(self) -> None:
-        """Start the cloning process and upload to S3 once cloning completes successfully."""
+        """Start the cloning process and upload to S3 once cloning completes successfully.
+
+        See Also:
+            - When ``pipeline`` is enabled, each archive is uploaded to S3 as soon as it is created.
+        """
         if self.env.cut_off_days:
             self.logger.info(
                 "Starting cloning process for repos that were updated in the last %d day(s), dry run: %s",
@@ -348,22 +1022,64 @@ class Git2S3:
             )
         else:
             self.logger.info("Starting cloning process, dry run: %s", str(self.env.dry_run).lower())
+        if self.env.stream_archive and (not self.env.pipeline or self.env.local_store or self.env.dry_run):
+            self.logger.warning(
+                "Streaming archives requires 'pipeline' without 'local_store' or 'dry_run', writing archives to disk."
+            )
+        elif self.env.stream_archive and squire.archive_extension(self.env.archive_format) == "bundle":
+            self.logger.warning("Streaming archives is not supported for git bundles, writing bundles to disk.")
+        elif self.env.stream_archive and self.env.content_addressed:
+            self.logger.warning(
+                "Streaming archives is not supported with 'content_addressed', writing archives to disk."
+            )
+        if self.env.disk_budget and not self.env.pipeline:
+            self.logger.warning(
+                "Archives are kept on disk until all the clones complete without 'pipeline', "
+                "so 'disk_budget' only caps the clones in flight."
+            )
+        self.journal.start(resume=self.resume)
+        if not self.env.dry_run and (self.env.incremental or self.env.pipeline or self.resume):
+            self.uploader = s3.Uploader(self.env, self.logger, self.journal, self.metrics, self.s3_client)
+        if self.env.incremental:
+            self.manifest.load(self.uploader)
+        if self.uploader and self.env.skip_unchanged_uploads and not self.env.content_addressed:
+            self.uploader.index(self.snapshots())
+        if config.SourceControl.wiki in self.env.source:
+            self.wiki_cache.load()
+        if not self.pipeline:
+            self.pipeline = squire.worker_pools(self.env)
         # Both processes run concurrently, calling the same function with different arguments
         processes = [ThreadPool(processes=1).apply_async(self.cloner, args=(config.SourceControl.repo,))]
         if config.SourceControl.gist in self.env.source:
             processes.append(ThreadPool(processes=1).apply_async(self.cloner, args=(config.SourceControl.gist,)))
         awaiter = all(process.get() for process in processes)
+        if config.SourceControl.wiki in self.env.source:
+            self.wiki_cache.save()
         self.logger.info("\n%s\n", json.dumps(self.clones, indent=2))
+        streamed = self.env.pipeline and self.uploader
         if awaiter:
             self.logger.info("All sources were cloned successfully.")
+        elif streamed:
+            self.logger.warning("Some cloning processes failed. Archives that were cloned successfully are uploaded.")
         else:
             # Proceed with a warning if incomplete upload is allowed
             if self.env.incomplete_upload:
                 self.logger.warning("Some cloning processes failed. Proceeding with incomplete upload.")
             else:
                 self.logger.error("Cloning process did not complete successfully. Skipping S3 backup.")
+                self.logger.info("Run 'git2s3 resume' to continue from where this run stopped.")
+                self.report()
+                self.journal.close()
+                if not self.shared:
+                    self.pipeline.shutdown()
                 return
-        if total := squire.check_file_presence(self.clone_dir):
+        total = squire.check_file_presence(self.clone_dir)
+        failed = 0
+        if streamed:
+            self.logger.info(
+                "%d objects were uploaded to S3 as soon as they were archived.", len(self.uploader.uploaded)
+            )
+        elif total:
             if self.env.dry_run:
                 self.logger.info(
                     "Dry run is set to true, skipping upload to S3 and enforcing local store. Files staged: %d",
@@ -373,23 +1089,53 @@ class Git2S3:
                 self.env.local_store = True
             else:
                 self.logger.info("Initiating S3 upload process. Total number of files: %d", total)
-                s3_upload = s3.Uploader(self.env, self.logger)
-                if failed := s3_upload.trigger():
+                if not self.uploader:
+                    self.uploader = s3.Uploader(self.env, self.logger, self.journal, self.metrics, self.s3_client)
+                    if self.env.skip_unchanged_uploads and not self.env.content_addressed:
+                        self.uploader.index(self.snapshots())
+                if failed := self.uploader.trigger(self.pipeline.upload):
                     self.logger.error("%d / %d objects failed to upload.", failed, total)
                 else:
                     self.logger.info("%d objects were uploaded to S3 successfully.", total)
-            if self.env.local_store:
-                local_store = os.path.join(self.env.backup_dir, config.BACKUP_PREFIX)
-                if os.path.isdir(local_store):
-                    self.logger.warning(
-                        "Local store [%s] is already available, deleting it..",
-                        local_store,
-                    )
-                    shutil.rmtree(local_store)
-                shutil.move(self.clone_dir, local_store)
-                self.logger.info("Local copy stored at: [%s]", local_store)
-            else:
-                self.logger.info("Deleting local copy!")
-                shutil.rmtree(self.clone_dir)
         else:
             self.logger.warning("No files found for S3 upload process.")
+        if self.uploader and self.uploader.reused:
+            self.logger.info("%d objects were identical to existing objects, and not uploaded.", self.uploader.reused)
+        if self.uploader and self.uploader.store and self.uploader.store.deduplicated:
+            self.logger.info(
+                "%d objects were identical to existing blobs, and not uploaded.", self.uploader.store.deduplicated
+            )
+        if total and self.env.local_store:
+            local_store = os.path.join(self.env.backup_dir, config.BACKUP_PREFIX)
+            if self.shared:
+                # owners that share the pools run concurrently, so each one is stored under its own directory
+                local_store = os.path.join(local_store, self.env.git_owner)
+                os.makedirs(os.path.dirname(local_store), exist_ok=True)
+            if os.path.isdir(local_store):
+                self.logger.warning(
+                    "Local store [%s] is already available, deleting it..",
+                    local_store,
+                )
+                shutil.rmtree(local_store)
+            shutil.move(self.clone_dir, local_store)
+            self.logger.info("Local copy stored at: [%s]", local_store)
+        elif (total or streamed) and os.path.isdir(self.clone_dir):
+            if awaiter and not failed:
+                self.logger.info("Deleting local copy!")
+                shutil.rmtree(self.clone_dir)
+            else:
+                # the archives that failed are picked up from the disk by 'resume', instead of cloning them again
+                self.logger.warning("Local copy retained at: [%s] for 'git2s3 resume'", self.clone_dir)
+        # Dry runs don't upload anything, so the state must not move forward
+        payload = None
+        if self.env.incremental and not self.env.dry_run:
+            blobs = self.uploader.store.blobs if self.uploader.store else None
+            payload = self.manifest.commit(self.uploader.uploaded, blobs)
+            self.manifest.save(payload, self.uploader)
+        if self.uploader and self.uploader.store:
+            self.uploader.store.save(self.snapshot_objects(payload))
+        self.report()
+        # the journal is retained when anything failed, so the failures can be retried with 'resume'
+        self.journal.close(remove=awaiter and not failed)
+        if not self.shared:
+            self.pipeline.shutdown()
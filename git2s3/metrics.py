@@ -0,0 +1,282 @@
+import contextlib
+import json
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Tuple
+
+from git2s3 import config, trace
+
+# Phases of the backup, in the order each entry goes through them
+PHASES: tuple = ("listing", "clone", "archive", "upload")
+# Latency percentiles included in the report
+QUANTILES: tuple = (0.5, 0.95)
+
+
+class Timing:
+    """Time an operation took, along with the process and the thread it ran on.
+
+    >>> Timing
+
+    """
+
+    __slots__ = ("start", "seconds", "pid", "thread")
+
+    def __init__(self, start: float, seconds: float, pid: int, thread: str):
+        """Instantiates the timing of a completed operation."""
+        self.start = start
+        self.seconds = seconds
+        self.pid = pid
+        self.thread = thread
+
+
+def timed(fn: Callable, *args, **kwargs) -> Tuple[Any, Timing]:
+    """Runs a function and measures how long it takes.
+
+    Args:
+        fn: Function to run.
+        args: Positional arguments for the function.
+        kwargs: Keyword arguments for the function.
+
+    See Also:
+        - Meant to be submitted to a pipeline stage, so the time spent waiting for a worker is not included.
+        - Module level function, so it can be submitted to a process pool along with a picklable function.
+
+    Returns:
+        Tuple[Any, Timing]:
+        Returns the return value of the function, and the time it took.
+    """
+    start = time.time()
+    counter = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, Timing(start, time.perf_counter() - counter, os.getpid(), threading.current_thread().name)
+
+
+def percentile(values: List[float], quantile: float) -> float:
+    """Get the nearest-rank percentile of a list of values.
+
+    Args:
+        values: Values to get the percentile of.
+        quantile: Quantile between 0 and 1.
+
+    Returns:
+        float:
+        Returns the percentile, or 0 when there are no values.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(math.ceil(quantile * len(ordered)), 1) - 1]
+
+
+class Metrics:
+    # noinspection PyUnresolvedReferences
+    """Collects the timings and the byte counts of each phase, for every repository/gist/wiki.
+
+    >>> Metrics
+
+    Keyword Args:
+        env: Environment configuration.
+        logger: Logger object.
+
+    See Also:
+        - Phases are ``listing`` (per page), ``clone``, ``archive`` and ``upload`` (per entry).
+        - Timings exclude the time spent waiting for a worker, so each phase's throughput is per worker.
+        - Streamed archives are compressed while uploading, so they are only recorded as ``upload``
+        - The report is stored as JSON and as a Prometheus textfile, when ``metrics_dir`` is set.
+        - Every phase and operation is also recorded as a span on a timeline, when ``trace_file`` is set.
+    """
+
+    def __init__(self, env: config.EnvConfig, logger: logging.Logger):
+        """Instantiates the metrics collector and starts the clock for the run."""
+        self.env = env
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.started = datetime.now(timezone.utc)
+        self.start = time.perf_counter()
+        self.entries: Dict[str, Dict[str, Dict[str, float]]] = {}
+        self.samples: Dict[str, List[Tuple[float, int]]] = {phase: [] for phase in PHASES}
+        self.tracer = trace.Tracer() if env.trace_file else None
+
+    def record(self, phase: str, key: str, timing: Timing, size: int = 0) -> None:
+        """Records the time and the bytes of a single phase for an entry.
+
+        Args:
+            phase: Phase of the backup.
+            key: Manifest key of the entry, or the page for listing.
+            timing: Time the phase took.
+            size: Number of bytes the phase processed.
+        """
+        seconds = timing.seconds
+        if self.tracer:
+            self.tracer.add(phase, timing.start, seconds, timing.pid, timing.thread, key=key, bytes=size)
+        with self.lock:
+            self.samples[phase].append((seconds, size))
+            # pages are only part of the phase summary, since they are not tied to an entry
+            if phase != "listing":
+                self.entries.setdefault(key, {})[phase] = {"seconds": round(seconds, 3), "bytes": size}
+
+    def span(self, name: str, **args: Any) -> contextlib.AbstractContextManager:
+        """Records a span for the operation within the context manager, when tracing is enabled.
+
+        Args:
+            name: Name of the operation.
+            args: Additional information about the operation, like the repository.
+
+        Returns:
+            contextlib.AbstractContextManager:
+            Returns the context manager that records the span.
+        """
+        if self.tracer:
+            return self.tracer.span(name, **args)
+        return contextlib.nullcontext()
+
+    def save_trace(self) -> None:
+        """Stores the trace of the run, along with a span that covers the entire run."""
+        self.tracer.add(
+            "start",
+            self.started.timestamp(),
+            time.perf_counter() - self.start,
+            os.getpid(),
+            threading.current_thread().name,
+            owner=self.env.git_owner,
+        )
+        self.tracer.save(self.env.trace_file)
+        self.logger.info("Trace stored at: [%s]", self.env.trace_file)
+
+    def report(self, counters: Dict[str, Dict[str, int]]) -> Dict[str, Any]:
+        """Summarizes the metrics of the run.
+
+        Args:
+            counters: Outcome counters for each source.
+
+        Returns:
+            Dict[str, Any]:
+            Returns the report with the counters, the summary of each phase and the metrics of each entry.
+        """
+        duration = time.perf_counter() - self.start
+        phases = {}
+        with self.lock:
+            for phase, samples in self.samples.items():
+                seconds = [sample[0] for sample in samples]
+                size = sum(sample[1] for sample in samples)
+                busy = sum(seconds)
+                phases[phase] = {
+                    "count": len(samples),
+                    "bytes": size,
+                    "seconds": round(busy, 3),
+                    "mb_per_sec": round(size / busy / 1_000_000, 3) if busy else 0.0,
+                    **{f"p{int(q * 100)}": round(percentile(seconds, q), 3) for q in QUANTILES},
+                    "max": round(max(seconds, default=0.0), 3),
+                }
+            entries = {key: dict(value) for key, value in self.entries.items()}
+        backed_up = sum(counter.get("success", 0) + counter.get("resumed", 0) for counter in counters.values())
+        return {
+            "owner": self.env.git_owner,
+            "snapshot": self.env.aws_s3_prefix,
+            "started": self.started.isoformat(),
+            "duration": round(duration, 3),
+            "counters": {str(source): dict(counter) for source, counter in counters.items()},
+            "throughput": {
+                "repos_per_min": round(backed_up / duration * 60, 3) if duration else 0.0,
+                "mb_per_sec": round(phases["upload"]["bytes"] / duration / 1_000_000, 3) if duration else 0.0,
+            },
+            "phases": phases,
+            "entries": entries,
+        }
+
+    def summarize(self, report: Dict[str, Any]) -> None:
+        """Logs the summary of each phase.
+
+        Args:
+            report: Report returned by ``report``
+        """
+        for phase, summary in report["phases"].items():
+            if not summary["count"]:
+                continue
+            self.logger.info(
+                "%-8s %5d items, %10.1f MB in %8.1fs [%.2f MB/s per worker] - p50: %.2fs, p95: %.2fs, max: %.2fs",
+                phase,
+                summary["count"],
+                summary["bytes"] / 1_000_000,
+                summary["seconds"],
+                summary["mb_per_sec"],
+                summary["p50"],
+                summary["p95"],
+                summary["max"],
+            )
+        self.logger.info(
+            "Completed in %.1fs - %.2f repos/min, %.2f MB/s uploaded",
+            report["duration"],
+            report["throughput"]["repos_per_min"],
+            report["throughput"]["mb_per_sec"],
+        )
+
+    def export(self, report: Dict[str, Any]) -> None:
+        """Stores the report as JSON and as a Prometheus textfile in the metrics directory.
+
+        Args:
+            report: Report returned by ``report``
+
+        See Also:
+            - Files are written to a temporary file and renamed, so collectors never read a partial file.
+        """
+        os.makedirs(self.env.metrics_dir, exist_ok=True)
+        json_file = os.path.join(self.env.metrics_dir, f"{self.env.git_owner}_metrics.json")
+        prom_file = os.path.join(self.env.metrics_dir, f"{self.env.git_owner}.prom")
+        for filepath, content in ((json_file, json.dumps(report, indent=2)), (prom_file, self.prometheus(report))):
+            tmp_file = f"{filepath}.{os.getpid()}.tmp"
+            with open(tmp_file, "w") as stream:
+                stream.write(content)
+                stream.flush()
+            os.replace(tmp_file, filepath)
+        self.logger.info("Metrics stored at: [%s] and [%s]", json_file, prom_file)
+
+    @staticmethod
+    def prometheus(report: Dict[str, Any]) -> str:
+        """Renders the report in the Prometheus text exposition format.
+
+        Args:
+            report: Report returned by ``report``
+
+        References:
+            https://prometheus.io/docs/instrumenting/exposition_formats/
+
+        Returns:
+            str:
+            Returns the metrics for the node exporter's textfile collector.
+        """
+        owner = report["owner"].replace("\\", "\\\\").replace('"', '\\"')
+        families = {
+            "git2s3_run_duration_seconds": ("gauge", "Duration of the last run.", []),
+            "git2s3_run_timestamp_seconds": ("gauge", "Start time of the last run.", []),
+            "git2s3_objects": ("gauge", "Repositories/gists/wikis by source and outcome.", []),
+            "git2s3_phase_items": ("gauge", "Items processed by each phase.", []),
+            "git2s3_phase_bytes": ("gauge", "Bytes processed by each phase.", []),
+            "git2s3_phase_seconds": ("gauge", "Time spent by each phase, across all the workers.", []),
+            "git2s3_phase_latency_seconds": ("gauge", "Latency percentiles of each phase.", []),
+        }
+        started = datetime.fromisoformat(report["started"]).timestamp()
+        families["git2s3_run_duration_seconds"][2].append((f'owner="{owner}"', report["duration"]))
+        families["git2s3_run_timestamp_seconds"][2].append((f'owner="{owner}"', started))
+        for source, counter in report["counters"].items():
+            for outcome, value in counter.items():
+                families["git2s3_objects"][2].append((f'owner="{owner}",source="{source}",outcome="{outcome}"', value))
+        for phase, summary in report["phases"].items():
+            labels = f'owner="{owner}",phase="{phase}"'
+            families["git2s3_phase_items"][2].append((labels, summary["count"]))
+            families["git2s3_phase_bytes"][2].append((labels, summary["bytes"]))
+            families["git2s3_phase_seconds"][2].append((labels, summary["seconds"]))
+            for quantile in QUANTILES:
+                families["git2s3_phase_latency_seconds"][2].append(
+                    (f'{labels},quantile="{quantile}"', summary[f"p{int(quantile * 100)}"])
+                )
+        lines = []
+        for name, (kind, description, samples) in families.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f"{name}{{{labels}}} {value}" for labels, value in samples)
+        return "\n".join(lines) + "\n"
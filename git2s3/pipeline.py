@@ -0,0 +1,192 @@
+import multiprocessing
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable
+
+
+class Stage:
+    # noinspection PyUnresolvedReferences
+    """Bounded worker pool for a single step of the backup pipeline.
+
+    >>> Stage
+
+    Keyword Args:
+        name: Name of the stage, used as the thread name prefix.
+        workers: Number of workers in the pool.
+        queue_size: Number of tasks that can wait for a worker, before submissions start blocking.
+        processes: Boolean flag to use a process pool instead of a thread pool, for CPU-bound tasks.
+
+    See Also:
+        - Process pools use the ``spawn`` start method, since forking a multithreaded process is unsafe.
+        - Tasks submitted to a process pool must be picklable, module level functions.
+    """
+
+    def __init__(self, name: str, workers: int, queue_size: int, processes: bool = False):
+        """Instantiates a bounded worker pool for a single step of the backup pipeline."""
+        self.name = name
+        self.workers = workers
+        if processes:
+            self.executor: Executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        else:
+            self.executor: Executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """Submits a task to the pool, blocking while the stage's queue is full.
+
+        Args:
+            fn: Function to run.
+            args: Positional arguments for the function.
+            kwargs: Keyword arguments for the function.
+
+        Returns:
+            Future:
+            Returns the future object for the submitted task.
+        """
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Runs a task in the pool and waits for it to complete.
+
+        Args:
+            fn: Function to run.
+            args: Positional arguments for the function.
+            kwargs: Keyword arguments for the function.
+
+        Returns:
+            Any:
+            Returns the return value of the function.
+        """
+        return self.submit(fn, *args, **kwargs).result()
+
+    def shutdown(self) -> None:
+        """Waits for the pending tasks and shuts down the pool."""
+        self.executor.shutdown(wait=True)
+
+
+class Pipeline:
+    # noinspection PyUnresolvedReferences
+    """Chains clone, archive and upload stages per repository, each with its own bounded pool.
+
+    >>> Pipeline
+
+    Keyword Args:
+        clone_workers: Number of concurrent clones.
+        archive_workers: Number of concurrent archives.
+        upload_workers: Number of concurrent uploads.
+        archive_processes: Boolean flag to archive in a process pool, so compression scales across cores.
+        disk_budget: Number of bytes the repositories in flight can hold on local disk, unlimited when not set.
+
+    See Also:
+        - Every repository is processed by a job that runs it through each stage, one after the other.
+        - The number of jobs in flight is bounded by the total number of workers across all stages.
+        - This caps the number of repositories that are held on local disk at any given time.
+        - A single pipeline can be shared by the backups of multiple owners, to bound them all together.
+    """
+
+    def __init__(
+        self,
+        clone_workers: int,
+        archive_workers: int,
+        upload_workers: int,
+        archive_processes: bool = False,
+        disk_budget: int | None = None,
+    ):
+        """Instantiates the clone, archive and upload stages."""
+        self.clone = Stage("clone", clone_workers, clone_workers)
+        self.archive = Stage("archive", archive_workers, archive_workers, processes=archive_processes)
+        self.upload = Stage("upload", upload_workers, upload_workers)
+        capacity = clone_workers + archive_workers + upload_workers
+        self.jobs = Stage("job", capacity, capacity)
+        self.budget = DiskBudget(disk_budget) if disk_budget else None
+
+    def shutdown(self) -> None:
+        """Waits for the pending jobs and shuts down all the stages."""
+        for stage in (self.jobs, self.clone, self.archive, self.upload):
+            stage.shutdown()
+
+
+class Reservation:
+    # noinspection PyUnresolvedReferences
+    """Disk space reserved for a single repository/gist/wiki, until its local files are deleted.
+
+    >>> Reservation
+
+    Keyword Args:
+        budget: Disk budget the space is reserved from.
+        size: Number of bytes reserved.
+    """
+
+    def __init__(self, budget: "DiskBudget", size: int):
+        """Instantiates the reservation for space that has already been admitted."""
+        self.budget = budget
+        self.size = size
+
+    def update(self, size: int) -> None:
+        """Replaces the estimate with a measured size, without waiting for the budget.
+
+        Args:
+            size: Number of bytes to reserve instead.
+        """
+        self.budget.adjust(size - self.size)
+        self.size = size
+
+    def release(self) -> None:
+        """Returns the reserved space to the budget."""
+        self.update(0)
+
+
+class DiskBudget:
+    # noinspection PyUnresolvedReferences
+    """Admission controller that caps the bytes held on local disk by the repositories in flight.
+
+    >>> DiskBudget
+
+    Keyword Args:
+        limit: Number of bytes that can be held on local disk at any given time.
+
+    See Also:
+        - Admission blocks while the reserved bytes along with the new reservation exceed the limit.
+        - A reservation larger than the limit is admitted once nothing else is in flight, instead of never.
+    """
+
+    def __init__(self, limit: int):
+        """Instantiates the disk budget with nothing reserved."""
+        self.limit = limit
+        self.used = 0
+        self.condition = threading.Condition()
+
+    def reserve(self, size: int) -> Reservation:
+        """Waits until the space can be reserved within the limit.
+
+        Args:
+            size: Estimated number of bytes to reserve.
+
+        Returns:
+            Reservation:
+            Returns the reservation, which has to be released once the local files are deleted.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: not self.used or self.used + size <= self.limit)
+            self.used += size
+        return Reservation(self, size)
+
+    def adjust(self, delta: int) -> None:
+        """Adjusts the reserved space, and wakes up the waiting reservations when space is returned.
+
+        Args:
+            delta: Number of bytes to add to the reserved space, negative to return space.
+        """
+        with self.condition:
+            self.used += delta
+            if delta < 0:
+                self.condition.notify_all()
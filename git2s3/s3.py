@@ -1,12 +1,155 @@
+import contextlib
+import io
+import json
 import logging
 import os
+import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterable, List, Optional, Set
 
 import boto3
 from botocore.config import Config
 from botocore.exceptions import BotoCoreError, ClientError
 
-from git2s3 import config, exc
+from git2s3 import config, exc, metrics, squire, state, store
+
+# S3 requires every part except the last one to be at least 5 MiB, and allows up to 10,000 parts
+MIN_PART_SIZE: int = 8 * 1024 * 1024
+MAX_PARTS: int = 10_000
+
+
+class MultipartWriter(io.RawIOBase):
+    # noinspection PyUnresolvedReferences
+    """Write-only file object that streams its content into an S3 multipart upload.
+
+    >>> MultipartWriter
+
+    Keyword Args:
+        s3_client: S3 client object.
+        bucket: Name of the S3 bucket.
+        key: S3 file path to upload to.
+        part_size: Size of each part, which is also the size of the in-memory buffer.
+
+    See Also:
+        - Only one part is held in memory at a time, regardless of the size of the object.
+        - Part size is doubled every 1,000 parts, to stay within the 10,000 parts limit for very large objects.
+        - The multipart upload is aborted if an exception is raised within the context manager.
+    """
+
+    def __init__(self, s3_client: Any, bucket: str, key: str, part_size: int = MIN_PART_SIZE):
+        """Creates a multipart upload for the given key."""
+        super().__init__()
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.buffer = bytearray()
+        self.parts = []
+        self.size = 0
+        self.etag: str | None = None
+        self.upload_id = self.s3_client.create_multipart_upload(Bucket=bucket, Key=key)["UploadId"]
+
+    def writable(self) -> bool:
+        """Flags the file object as writable."""
+        return True
+
+    def write(self, data: bytes) -> int:
+        """Buffers the data and uploads a part each time the buffer is full.
+
+        Args:
+            data: Bytes to write.
+
+        Returns:
+            int:
+            Returns the number of bytes written.
+        """
+        self.buffer += data
+        self.size += len(data)
+        while len(self.buffer) >= self.part_size:
+            chunk = bytes(self.buffer[: self.part_size])
+            del self.buffer[: self.part_size]
+            self.upload_part(chunk)
+        return len(data)
+
+    def upload_part(self, chunk: bytes) -> None:
+        """Uploads a single part of the multipart upload.
+
+        Args:
+            chunk: Bytes to upload as a part.
+        """
+        part_number = len(self.parts) + 1
+        response = self.s3_client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=chunk,
+        )
+        self.parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+        if part_number % (MAX_PARTS // 10) == 0:
+            self.part_size *= 2
+
+    def close(self) -> None:
+        """Uploads the remaining buffer as the last part and completes the multipart upload."""
+        if self.closed:
+            return
+        if self.buffer or not self.parts:
+            self.upload_part(bytes(self.buffer))
+            self.buffer.clear()
+        response = self.s3_client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={"Parts": self.parts},
+        )
+        self.etag = response["ETag"].strip('"')
+        super().close()
+
+    def abort(self) -> None:
+        """Aborts the multipart upload, so the uploaded parts are not retained in the bucket."""
+        self.buffer.clear()
+        self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        super().close()
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        """Completes the multipart upload, or aborts it if an exception was raised."""
+        if exc_type:
+            self.abort()
+        else:
+            self.close()
+
+
+def client(env: config.EnvConfig) -> Any:
+    """Creates the S3 client.
+
+    Args:
+        env: Environment configuration.
+
+    See Also:
+        - Clients are thread safe, so a single client can be shared by the backups of multiple owners.
+
+    References:
+        - https://boto3.amazonaws.com/v1/documentation/api/latest/guide/retries.html
+        - https://botocore.amazonaws.com/v1/documentation/api/latest/reference/config.html
+
+    Returns:
+        Any:
+        Returns the S3 client, with a connection for each upload worker.
+    """
+    session = boto3.Session(
+        aws_access_key_id=env.aws_access_key_id,
+        aws_secret_access_key=env.aws_secret_access_key,
+        region_name=env.aws_region_name,
+        profile_name=env.aws_profile_name,
+    )
+    return session.client(
+        "s3",
+        endpoint_url=str(env.aws_endpoint_url) if env.aws_endpoint_url else None,
+        config=Config(
+            retries=dict(max_attempts=env.boto3_retry_attempts, mode=env.boto3_retry_mode),
+            max_pool_connections=max(env.upload_workers, 10),
+        ),
+    )
 
 
 class Uploader:
@@ -18,57 +161,290 @@ class Uploader:
     Keyword Args:
         env: Environment configuration.
         logger: Logger object.
+        journal: Journal of the run, to record the uploads and skip the ones from an interrupted run.
+        metrics: Metrics collector of the run, to record the time and the size of each upload.
+        s3_client: S3 client to share with other uploaders, a new client is created when not set.
     """
 
-    def __init__(self, env: config.EnvConfig, logger: logging.Logger):
-        """Concurrent uploader object to upload files to S3.
-
-        References:
-            - https://boto3.amazonaws.com/v1/documentation/api/latest/guide/retries.html
-            - https://botocore.amazonaws.com/v1/documentation/api/latest/reference/config.html
-        """
-        session = boto3.Session(
-            aws_access_key_id=env.aws_access_key_id,
-            aws_secret_access_key=env.aws_secret_access_key,
-            region_name=env.aws_region_name,
-            profile_name=env.aws_profile_name,
-        )
+    def __init__(
+        self,
+        env: config.EnvConfig,
+        logger: logging.Logger,
+        journal: state.Journal | None = None,
+        metrics: metrics.Metrics | None = None,
+        s3_client: Any = None,
+    ):
+        """Concurrent uploader object to upload files to S3."""
+        self.env = env
         self.logger = logger
+        self.journal = journal
+        self.metrics = metrics
         self.bucket = env.aws_bucket_name
         self.prefix = env.aws_s3_prefix
-        self.base_path = os.path.join(os.getcwd(), env.git_owner)
-        self.s3_client = session.client(
-            "s3",
-            config=Config(retries=dict(max_attempts=env.boto3_retry_attempts, mode=env.boto3_retry_mode)),
-        )
+        self.workers = env.upload_workers
+        # multi-owner configurations only use the uploader for garbage collection, which spans all the owners
+        self.base_path = os.path.join(env.backup_dir, env.git_owner) if env.git_owner else None
+        self.uploaded: Set[str] = set()
+        self.reused: int = 0
+        self.objects: Dict[str, Dict[str, Any]] | None = None
+        self.previous: Dict[str, str] = {}
+        self.lock = threading.Lock()
+        self.s3_client = s3_client or client(env)
+        self.store = store.BlobStore(env, logger, self.s3_client) if env.content_addressed else None
 
     def upload_file(self, local_file_path: str | os.PathLike, s3_file_path: str | os.PathLike) -> None:
-        """Uploads an object to S3.
+        """Uploads an object to S3, and records the time it took.
+
+        Args:
+            local_file_path: Local file path to upload from.
+            s3_file_path: S3 file path to upload to.
+        """
+        _, timing = metrics.timed(self.put, local_file_path, s3_file_path)
+        if self.metrics:
+            self.metrics.record("upload", self.entry_key(s3_file_path), timing, os.path.getsize(local_file_path))
+
+    def put(self, local_file_path: str | os.PathLike, s3_file_path: str | os.PathLike) -> None:
+        """Uploads an object to S3, unless it is identical to an existing object or blob.
 
         Args:
             local_file_path: Local file path to upload from.
             s3_file_path: S3 file path to upload to.
         """
         try:
+            if self.store:
+                blob = self.store.put(local_file_path, s3_file_path)
+                with self.lock:
+                    self.uploaded.add(s3_file_path)
+                if self.journal:
+                    self.journal.write("uploaded", object=s3_file_path, blob=blob)
+                return
+            if self.objects is not None and self.reuse(local_file_path, s3_file_path):
+                if self.journal:
+                    self.journal.write("uploaded", object=s3_file_path)
+                return
             self.s3_client.upload_file(local_file_path, self.bucket, s3_file_path)
+            with self.lock:
+                self.uploaded.add(s3_file_path)
             self.logger.info("Uploaded '%s' to 's3://%s'", s3_file_path, self.bucket)
+            if self.journal:
+                # upload_file doesn't return the response, and this also verifies that the object landed
+                etag = self.s3_client.head_object(Bucket=self.bucket, Key=s3_file_path)["ETag"]
+                self.journal.write("uploaded", object=s3_file_path, etag=etag.strip('"'))
         except (FileNotFoundError, BotoCoreError, ClientError) as error:
             raise exc.UploadError(error)
 
-    def trigger(self) -> int:
+    def index(self, prefixes: Iterable[str]) -> None:
+        """Lists the existing objects in the backup prefix and the previous snapshots, to skip unchanged uploads.
+
+        Args:
+            prefixes: Previous snapshot prefixes, to copy the unchanged archives from.
+        """
+        objects = {}
+        previous = {}
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        for prefix in [self.prefix] + sorted(set(prefixes) - {self.prefix}):
+            try:
+                for page in paginator.paginate(Bucket=self.bucket, Prefix=f"{prefix}/"):
+                    for content in page.get("Contents", []):
+                        objects[content["Key"]] = content
+                        relative = content["Key"].removeprefix(f"{prefix}/")
+                        # the latest copy of an archive across the snapshots is used as the source
+                        if prefix != self.prefix and (
+                            relative not in previous
+                            or content["LastModified"] > objects[previous[relative]]["LastModified"]
+                        ):
+                            previous[relative] = content["Key"]
+            except (BotoCoreError, ClientError) as error:
+                self.logger.warning("Failed to list 's3://%s/%s' - %s", self.bucket, prefix, error)
+        self.logger.info("Found %d existing objects to compare the archives against", len(objects))
+        self.objects = objects
+        self.previous = previous
+
+    def reuse(self, local_file_path: str | os.PathLike, s3_file_path: str) -> bool:
+        """Skips the upload if an identical object exists, or copies it server-side from a previous snapshot.
+
+        Args:
+            local_file_path: Local file path to upload from.
+            s3_file_path: S3 file path to upload to.
+
+        Returns:
+            bool:
+            Returns a boolean flag to indicate if an identical object was reused.
+        """
+        size = os.path.getsize(local_file_path)
+        candidates = [s3_file_path, self.previous.get(s3_file_path.removeprefix(f"{self.prefix}/"))]
+        for key in filter(None, candidates):
+            existing = self.objects.get(key)
+            if not existing or existing["Size"] != size:
+                continue
+            if squire.s3_etag(local_file_path, existing["ETag"], MIN_PART_SIZE) != existing["ETag"].strip('"'):
+                continue
+            if key == s3_file_path:
+                self.logger.info("Skipped uploading '%s', reason: identical object exists", s3_file_path)
+            else:
+                # server-side copy, managed transfer switches to multipart copy for objects over 5 GB
+                self.s3_client.copy({"Bucket": self.bucket, "Key": key}, self.bucket, s3_file_path)
+                self.logger.info("Copied '%s' to '%s', reason: identical object exists", key, s3_file_path)
+            with self.lock:
+                self.uploaded.add(s3_file_path)
+                self.reused += 1
+            return True
+        return False
+
+    def stream_archive(self, destination: str | os.PathLike, s3_file_path: str | os.PathLike) -> None:
+        """Archives a directory straight into an S3 multipart upload, and records the time it took.
+
+        Args:
+            destination: Directory path to be archived.
+            s3_file_path: S3 file path to upload to.
+        """
+        size, timing = metrics.timed(self.stream, destination, s3_file_path)
+        if self.metrics:
+            self.metrics.record("upload", self.entry_key(s3_file_path), timing, size)
+
+    def stream(self, destination: str | os.PathLike, s3_file_path: str | os.PathLike) -> int:
+        """Archives a directory straight into an S3 multipart upload, without writing the archive to disk.
+
+        Args:
+            destination: Directory path to be archived.
+            s3_file_path: S3 file path to upload to.
+
+        Returns:
+            int:
+            Returns the number of bytes uploaded.
+        """
+        try:
+            with MultipartWriter(self.s3_client, self.bucket, s3_file_path) as writer:
+                squire.archive_stream(
+                    destination,
+                    writer,
+                    self.env.archive_format,
+                    self.env.compression_level,
+                    self.env.compression_threads,
+                )
+            with self.lock:
+                self.uploaded.add(s3_file_path)
+            self.logger.info("Streamed '%s' to 's3://%s' [%d bytes]", s3_file_path, self.bucket, writer.size)
+            if self.journal:
+                self.journal.write("uploaded", object=s3_file_path, etag=writer.etag)
+        except (OSError, BotoCoreError, ClientError) as error:
+            raise exc.UploadError(error)
+        return writer.size
+
+    def entry_key(self, s3_file_path: str) -> str:
+        """Get the manifest key of an archive, to relate its upload to the rest of its phases.
+
+        Args:
+            s3_file_path: S3 file path of the archive.
+
+        Returns:
+            str:
+            Returns the archive's path relative to the backup prefix, without the extension.
+        """
+        relative = s3_file_path.removeprefix(f"{self.prefix}/")
+        extension = next((ext for ext in squire.ARCHIVE_EXTENSIONS if relative.endswith(ext)), "")
+        return relative.removesuffix(extension) if extension else relative
+
+    def object_key(self, local_file_path: str | os.PathLike) -> str:
+        """Get the S3 object key for a local file.
+
+        Args:
+            local_file_path: Local file path within the clone directory.
+
+        Returns:
+            str:
+            Returns the S3 file path, prefixed with the backup prefix.
+        """
+        return os.path.join(self.prefix, os.path.relpath(local_file_path, self.base_path))
+
+    def keys(self, prefix: str) -> List[str]:
+        """Lists the S3 object keys under a prefix.
+
+        Args:
+            prefix: Prefix to list the objects from.
+
+        Returns:
+            List[str]:
+            Returns the list of object keys.
+        """
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        try:
+            return [
+                content["Key"]
+                for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix)
+                for content in page.get("Contents", [])
+            ]
+        except (BotoCoreError, ClientError) as error:
+            self.logger.warning("Failed to list 's3://%s/%s' - %s", self.bucket, prefix, error)
+            return []
+
+    def download_json(self, s3_file_path: str) -> Optional[Dict[str, Any]]:
+        """Downloads a JSON object from S3.
+
+        Args:
+            s3_file_path: S3 file path to download from.
+
+        Returns:
+            Dict[str, Any]:
+            Returns the JSON object as a dictionary, or None if the object is unavailable.
+        """
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=s3_file_path)
+            return json.loads(response["Body"].read())
+        except ClientError as error:
+            if error.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404"):
+                self.logger.warning("Failed to download 's3://%s/%s' - %s", self.bucket, s3_file_path, error)
+        except (BotoCoreError, ValueError) as error:
+            self.logger.warning("Failed to download 's3://%s/%s' - %s", self.bucket, s3_file_path, error)
+
+    def upload_json(self, s3_file_path: str, data: Dict[str, Any]) -> None:
+        """Uploads a dictionary as a JSON object to S3.
+
+        Args:
+            s3_file_path: S3 file path to upload to.
+            data: Dictionary to upload.
+        """
+        try:
+            self.s3_client.put_object(
+                Bucket=self.bucket,
+                Key=s3_file_path,
+                Body=json.dumps(data, indent=2).encode(),
+                ContentType="application/json",
+            )
+            self.logger.info("Uploaded '%s' to 's3://%s'", s3_file_path, self.bucket)
+        except (BotoCoreError, ClientError) as error:
+            raise exc.UploadError(error)
+
+    def gc(self) -> int:
+        """Runs garbage collection on the content addressed store.
+
+        Returns:
+            int:
+            Returns the number of blobs that were deleted.
+        """
+        return (self.store or store.BlobStore(self.env, self.logger, self.s3_client)).gc()
+
+    def trigger(self, stage: Any = None) -> int:
         """Trigger to upload all file objects concurrently to S3.
 
+        Args:
+            stage: ``pipeline.Stage`` to upload with, so the uploads are bounded along with the other backups.
+
         Returns:
             int:
             Returns a failed count to indiciate the number files that were failed to upload.
         """
         futures = {}
-        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        with contextlib.nullcontext(stage) if stage else ThreadPoolExecutor(max_workers=self.workers) as executor:
             for root, dirs, files in os.walk(self.base_path):
                 for file in files:
                     local_file_path = os.path.join(root, file)
-                    relative_path = os.path.relpath(local_file_path, self.base_path)
-                    s3_file_path = os.path.join(self.prefix, relative_path)
+                    s3_file_path = self.object_key(local_file_path)
+                    if self.journal and s3_file_path in self.journal.uploaded:
+                        # uploaded before the run was interrupted
+                        with self.lock:
+                            self.uploaded.add(s3_file_path)
+                        continue
                     future = executor.submit(self.upload_file, local_file_path, s3_file_path)
                     futures[future] = s3_file_path
         failed = 0
@@ -0,0 +1,113 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from git2s3 import config, s3, squire, state
+from git2s3.main import Git2S3
+
+
+class Scheduler:
+    # noinspection PyUnresolvedReferences
+    """Backs up multiple owners/organizations in a single process, with the pools shared between them.
+
+    >>> Scheduler
+
+    Keyword Args:
+        env_file: Environment configuration.
+        logger: Bring your own logger object.
+        resume: Boolean flag to resume the interrupted runs from their journals.
+        env: Environment configuration to use instead of loading the ``env_file``
+
+    See Also:
+        - Clones, archives and uploads of all the owners are bounded by the same worker pools and disk budget.
+        - API requests of all the owners go through one session, so they share the connection pool and rate limit.
+        - Each owner has its own clone directory, state manifest, journal and metrics, and its own prefix in S3.
+        - Up to ``owner_workers`` owners are backed up concurrently, in the order they are listed.
+    """
+
+    def __init__(
+        self,
+        env_file: str | os.PathLike = ".env",
+        logger: logging.Logger = None,
+        resume: bool = False,
+        env: config.EnvConfig | None = None,
+    ):
+        """Instantiates the scheduler along with the session, the pools and the S3 client for all the owners."""
+        self.env = env or squire.env_loader(env_file)
+        if not self.env.git_owners:
+            raise ValueError("'git_owners' must be set to back up multiple owners, use 'git2s3.Git2S3' otherwise.")
+        self.logger = logger or squire.default_logger(self.env)
+        self.resume = resume
+        self.session = squire.github_session(self.env, self.logger)
+        self.pipeline = squire.worker_pools(self.env)
+        self.s3_client = None if self.env.dry_run else s3.client(self.env)
+
+    def backup(self, owner: config.Owner) -> None:
+        """Backs up a single owner with the shared session, pools and S3 client.
+
+        Args:
+            owner: Owner along with its overrides.
+        """
+        Git2S3(
+            logger=self.logger,
+            resume=self.resume,
+            env=self.env.for_owner(owner),
+            session=self.session,
+            pool=self.pipeline,
+            s3_client=self.s3_client,
+        ).start()
+
+    def start(self) -> bool:
+        """Starts the backup for all the owners.
+
+        Returns:
+            bool:
+            Returns a boolean flag to indicate if none of the backups raised an exception.
+        """
+        success = True
+        try:
+            with ThreadPoolExecutor(max_workers=self.env.owner_workers, thread_name_prefix="owner") as executor:
+                futures = {executor.submit(self.backup, owner): owner.name for owner in self.env.git_owners}
+                for future in as_completed(futures):
+                    if future.exception():
+                        success = False
+                        self.logger.error(
+                            "Thread backing up the owner '%s' received an exception: %s",
+                            futures[future],
+                            future.exception(),
+                        )
+                    else:
+                        self.logger.info("Backup completed for the owner '%s'", futures[future])
+        finally:
+            self.pipeline.shutdown()
+        return success
+
+
+def merge(env: config.EnvConfig, logger: logging.Logger) -> bool:
+    """Assembles the manifests of a snapshot from the parts stored by each shard, once all the shards complete.
+
+    Args:
+        env: Environment configuration.
+        logger: Logger object.
+
+    See Also:
+        - Assembles the state manifest with ``incremental``, and the snapshot manifest with ``content_addressed``
+        - Every owner is merged when ``git_owners`` is set.
+
+    Returns:
+        bool:
+        Returns a boolean flag to indicate if all the manifests were assembled.
+    """
+    env = env.model_copy(update={"shard": None})
+    if not env.incremental and not env.content_addressed:
+        logger.warning("Shards only store manifests with 'incremental' or 'content_addressed', nothing to merge.")
+        return True
+    s3_client = s3.client(env)
+    success = True
+    for owner_env in [env.for_owner(owner) for owner in env.git_owners] or [env]:
+        uploader = s3.Uploader(owner_env, logger, s3_client=s3_client)
+        if owner_env.incremental:
+            success = state.Manifest(owner_env, logger).merge(uploader) and success
+        if owner_env.content_addressed:
+            success = uploader.store.merge() and success
+    return success
@@ -1,31 +1,267 @@
+import gzip
+import hashlib
 import json
 import logging
 import os
 import pathlib
+import re
 import shutil
+import stat
+import tarfile
+import zipfile
+from collections.abc import Generator
 from datetime import datetime, timedelta, timezone
-from typing import Any, Dict
+from typing import Any, BinaryIO, Dict, Iterable, List
+from urllib.parse import urlsplit
 
+import requests
 import yaml
+from pydantic import HttpUrl
 
-from git2s3 import config
+from git2s3 import api, config, pipeline
 
+ARCHIVE_EXTENSIONS: tuple = (".zip", ".bundle", ".tar.gz", ".tar.zst")
+# Files that are already compressed, and are stored as-is instead of being compressed again
+COMPRESSED_EXTENSIONS: tuple = (
+    ".pack",
+    ".bitmap",
+    ".zip",
+    ".gz",
+    ".tgz",
+    ".bz2",
+    ".xz",
+    ".zst",
+    ".7z",
+    ".jar",
+    ".png",
+    ".jpg",
+    ".jpeg",
+    ".gif",
+    ".webp",
+    ".mp3",
+    ".mp4",
+    ".mov",
+)
+# Errors from git when the remote repository doesn't exist, as opposed to network, server or auth failures
+REPOSITORY_MISSING: re.Pattern = re.compile(
+    r"repository not found|repository '.+' not found|does not appear to be a git repository", re.IGNORECASE
+)
+# Size of the chunks the files are copied into an archive with, which bounds each write to the archive's sink
+COPY_CHUNK_SIZE: int = 1024 * 1024
+# Earliest timestamp supported by the zip format, used for all entries to make the archives reproducible
+ZIP_TIMESTAMP: tuple = (1980, 1, 1, 0, 0, 0)
+GRAPHQL_REPOSITORIES: str = """
+query($owner: String!, $first: Int!, $after: String, $orderBy: RepositoryOrder) {
+  repositoryOwner(login: $owner) {
+    repositories(first: $first, after: $after, ownerAffiliations: OWNER, orderBy: $orderBy) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        databaseId name url description isPrivate pushedAt updatedAt hasWikiEnabled diskUsage
+        defaultBranchRef { target { oid } }
+      }
+    }
+  }
+}
+"""
 
-def archer(destination: str) -> None:
-    """Archives a given directory and deletes it while retaining the zipfile.
+
+def archer(
+    destination: str,
+    archive_format: config.ArchiveFormat = config.ArchiveFormat.zip,
+    level: int | None = None,
+    threads: int = 0,
+) -> None:
+    """Archives a given directory and deletes it while retaining the archive.
 
     Args:
         destination: Directory path to be archived.
+        archive_format: Archive format for the backup.
+        level: Compression level, defaults to the codec's default level.
+        threads: Number of threads for compression, where supported.
 
     Raises:
         AssertionError:
-        If zipfile is not present after archiving.
+        If archive is not present after archiving.
     """
-    shutil.make_archive(destination, "zip", destination)
-    assert os.path.isfile(f"{destination}.zip")
+    archive = f"{destination}.{archive_extension(archive_format)}"
+    with open(archive, "wb") as fileobj:
+        archive_stream(destination, fileobj, archive_format, level, threads)
+    assert os.path.isfile(archive)
     shutil.rmtree(destination)
 
 
+def archive_stream(
+    destination: str | os.PathLike,
+    fileobj: BinaryIO,
+    archive_format: config.ArchiveFormat = config.ArchiveFormat.zip,
+    level: int | None = None,
+    threads: int = 0,
+) -> None:
+    """Archives a given directory into a file object, in the given archive format.
+
+    Args:
+        destination: Directory path to be archived.
+        fileobj: Writable file object, which doesn't have to be seekable.
+        archive_format: Archive format for the backup.
+        level: Compression level, defaults to the codec's default level.
+        threads: Number of threads for compression, where supported.
+    """
+    if archive_format in (config.ArchiveFormat.tar_gz, config.ArchiveFormat.tar_zst):
+        tar_stream(destination, fileobj, archive_format, level, threads)
+    else:
+        zip_stream(destination, fileobj, store=archive_format == config.ArchiveFormat.zip_store, level=level)
+
+
+def walk(destination: str | os.PathLike) -> Generator[str]:
+    """Walks through a directory in a sorted order, so the archives are reproducible.
+
+    Args:
+        destination: Directory path to be walked.
+
+    Yields:
+        str:
+        Yields the path of every directory and file within the destination.
+    """
+    for root, dirs, files in os.walk(destination):
+        # os.walk traverses the directories in the order of this list
+        dirs.sort()
+        for name in dirs + sorted(files):
+            yield os.path.join(root, name)
+
+
+def zip_stream(
+    destination: str | os.PathLike, fileobj: BinaryIO, store: bool = False, level: int | None = None
+) -> None:
+    """Archives a given directory into a file object, with the same layout as ``shutil.make_archive``.
+
+    Args:
+        destination: Directory path to be archived.
+        fileobj: Writable file object, which doesn't have to be seekable.
+        store: Boolean flag to store all the files without compression.
+        level: Compression level for deflate, from 0 to 9.
+
+    See Also:
+        - Archives are reproducible, the entries are sorted and stored with a fixed timestamp and permissions.
+        - So the same content always results in the same archive, which can be compared against existing objects.
+        - Files that are already compressed (like git packfiles) are stored as-is, instead of compressing them again.
+    """
+    with zipfile.ZipFile(fileobj, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=level) as zf:
+        for path in walk(destination):
+            arcname = os.path.relpath(path, destination)
+            if os.path.isdir(path):
+                info = zipfile.ZipInfo(f"{arcname}/", date_time=ZIP_TIMESTAMP)
+                info.external_attr = (stat.S_IFDIR | 0o755) << 16 | 0x10
+                zf.writestr(info, b"")
+            # Skip broken symlinks, just like shutil.make_archive
+            elif os.path.isfile(path):
+                info = zipfile.ZipInfo(arcname, date_time=ZIP_TIMESTAMP)
+                mode = 0o755 if os.access(path, os.X_OK) else 0o644
+                info.external_attr = (stat.S_IFREG | mode) << 16
+                if store or path.lower().endswith(COMPRESSED_EXTENSIONS):
+                    info.compress_type = zipfile.ZIP_STORED
+                else:
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                    # ZipFile.open doesn't apply the archive's compression level to ZipInfo objects
+                    if hasattr(info, "compress_level"):
+                        info.compress_level = level
+                    else:
+                        # public attribute is only available from python 3.13
+                        info._compresslevel = level
+                info.file_size = os.path.getsize(path)
+                # copied in chunks, so neither the file nor its compressed output is held in memory
+                with (
+                    open(path, "rb") as src,
+                    zf.open(info, "w", force_zip64=info.file_size > zipfile.ZIP64_LIMIT) as dst,
+                ):
+                    shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+
+
+def tar_stream(
+    destination: str | os.PathLike,
+    fileobj: BinaryIO,
+    archive_format: config.ArchiveFormat,
+    level: int | None = None,
+    threads: int = 0,
+) -> None:
+    """Archives a given directory into a file object as a compressed tarball.
+
+    Args:
+        destination: Directory path to be archived.
+        fileobj: Writable file object, which doesn't have to be seekable.
+        archive_format: Archive format for the backup, either ``tar_gz`` or ``tar_zst``
+        level: Compression level for the codec.
+        threads: Number of threads for zstd compression, 0 to use all the cores.
+
+    See Also:
+        - Tarballs are reproducible, with sorted entries and normalized timestamps, ownership and permissions.
+        - zstd skips incompressible blocks on its own, so already compressed files cost very little CPU.
+    """
+    if archive_format == config.ArchiveFormat.tar_zst:
+        import zstandard
+
+        compressor = zstandard.ZstdCompressor(
+            level=3 if level is None else level, threads=threads or (os.cpu_count() or 1)
+        )
+        stream = compressor.stream_writer(fileobj, closefd=False)
+    else:
+        # fixed mtime and no filename in the gzip header, so the output is reproducible
+        stream = gzip.GzipFile(
+            filename="", mode="wb", fileobj=fileobj, mtime=0, compresslevel=9 if level is None else level
+        )
+    with stream, tarfile.open(fileobj=stream, mode="w|", format=tarfile.PAX_FORMAT) as tf:
+        for path in walk(destination):
+            info = tf.gettarinfo(path, os.path.relpath(path, destination))
+            info.mtime = 0
+            info.uid = info.gid = 0
+            info.uname = info.gname = ""
+            if info.isdir():
+                info.mode = 0o755
+                tf.addfile(info)
+            elif info.isreg():
+                info.mode = 0o755 if info.mode & stat.S_IXUSR else 0o644
+                with open(path, "rb") as src:
+                    tf.addfile(info, src)
+            else:
+                tf.addfile(info)
+
+
+def s3_etag(filepath: str | os.PathLike, remote_etag: str, part_size: int) -> str:
+    """Computes the S3 ETag of a local file, to compare against an existing object without downloading it.
+
+    Args:
+        filepath: Local file path.
+        remote_etag: ETag of the existing object, to detect the number of parts it was uploaded with.
+        part_size: Default part size of the multipart uploads.
+
+    See Also:
+        - ETag of a single part upload is the MD5 of the object.
+        - ETag of a multipart upload is the MD5 of the concatenated MD5s of the parts, followed by the number of parts.
+        - Objects encrypted with SSE-KMS don't have an MD5 based ETag, so they never match.
+
+    Returns:
+        str:
+        Returns the ETag without the quotes.
+    """
+    remote_etag = remote_etag.strip('"')
+    if "-" not in remote_etag:
+        digest = hashlib.md5(usedforsecurity=False)
+        with open(filepath, "rb") as stream:
+            while chunk := stream.read(1024 * 1024):
+                digest.update(chunk)
+        return digest.hexdigest()
+    parts = int(remote_etag.rsplit("-", 1)[1])
+    size = os.path.getsize(filepath)
+    if -(-size // part_size) != parts:
+        # uploaded with a different part size, the closest guess is the smallest whole MiB that fits the parts
+        mib = 1024 * 1024
+        part_size = -(-size // parts // mib) * mib or mib
+    digests = []
+    with open(filepath, "rb") as stream:
+        while chunk := stream.read(part_size):
+            digests.append(hashlib.md5(chunk, usedforsecurity=False).digest())
+    return f"{hashlib.md5(b''.join(digests), usedforsecurity=False).hexdigest()}-{len(digests)}"
+
+
 def env_loader(filename: str | os.PathLike) -> config.EnvConfig:
     """Loads environment variables based on filetypes.
 
@@ -58,33 +294,248 @@ def env_loader(filename: str | os.PathLike) -> config.EnvConfig:
 
 
 def source_detector(source: Dict[str, Any], env: config.EnvConfig) -> config.DataStore:
-    """Detects the type of source to clone and returns the DataStore model.
+    """Detects the type of source to clone and returns the DataStore record.
 
     Args:
         source: Repository/Gist information as a dict.
         env: Environment configuration.
 
+    See Also:
+        - ``pushed_at`` works only for repos, ``updated_at`` works for both but includes updates to metadata, PRs etc.
+
     Returns:
         config.DataStore:
-        DataStore model.
+        DataStore record.
     """
     if source.get("comments_url") == f"{env.git_api_url}/gists/{source['id']}/comments":
         return config.DataStore(
             source=config.SourceControl.gist,
             clone_url=source["git_pull_url"],
             name=source["id"],
-            description=source["description"],
             private=not source["public"],
+            description=source["description"],
+            updated_at=source.get("updated_at"),
+            size=listed_size(source),
         )
     return config.DataStore(
         source=config.SourceControl.repo,
         clone_url=source["clone_url"],
         name=source["name"],
-        description=source["description"],
         private=source["private"],
+        description=source["description"],
+        updated_at=source.get("pushed_at") or source.get("updated_at"),
+        head=source.get("head_oid"),
+        has_wiki=bool(source.get("has_wiki")),
+        size=listed_size(source),
     )
 
 
+def graphql_endpoint(api_url: str) -> str:
+    """Get the GraphQL endpoint for a REST API URL.
+
+    Args:
+        api_url: GitHub REST API endpoint.
+
+    See Also:
+        - GitHub Enterprise serves REST from ``/api/v3`` and GraphQL from ``/api/graphql``
+
+    Returns:
+        str:
+        Returns the GraphQL endpoint.
+    """
+    if api_url.endswith("/api/v3"):
+        return api_url.removesuffix("/v3") + "/graphql"
+    return f"{api_url}/graphql"
+
+
+def graphql_repository(node: Dict[str, Any]) -> Dict[str, Any]:
+    """Converts a GraphQL repository node into the shape of the REST API response.
+
+    Args:
+        node: Repository node from the GraphQL response.
+
+    Returns:
+        Dict[str, Any]:
+        Returns the repository information with the same keys as the REST API, along with ``head_oid``
+    """
+    default_branch = node.get("defaultBranchRef") or {}
+    return {
+        "id": node["databaseId"],
+        "name": node["name"],
+        "html_url": node["url"],
+        "clone_url": f"{node['url']}.git",
+        "description": node["description"],
+        "private": node["isPrivate"],
+        "pushed_at": node["pushedAt"],
+        "updated_at": node["updatedAt"],
+        "has_wiki": node["hasWikiEnabled"],
+        "size": node["diskUsage"],
+        # empty repositories don't have a default branch
+        "head_oid": (default_branch.get("target") or {}).get("oid"),
+    }
+
+
+def is_stale_page(entries: List[Dict[str, Any]], n_days: int) -> bool:
+    """Check if every entry in a page of the listing was last pushed/updated before the cut off.
+
+    Args:
+        entries: Repository/Gist information from a single page.
+        n_days: Number of days to compare against from the current UTC time.
+
+    See Also:
+        - Entries without a timestamp are never considered stale, so an empty page is not stale either.
+
+    Returns:
+        bool:
+        Returns a boolean flag to indicate if the page is stale.
+    """
+    for entry in entries:
+        last_updated = entry.get("pushed_at") or entry.get("updated_at")
+        if not last_updated or not is_older_than_n_days(last_updated, n_days):
+            return False
+    return bool(entries)
+
+
+def in_shard(key: str, shard: str) -> bool:
+    """Check if a repository/gist belongs to a shard.
+
+    Args:
+        key: Source type and name of the repository/gist, which don't change with its visibility.
+        shard: Shard as ``INDEX/COUNT``
+
+    See Also:
+        - Uses a stable hash instead of ``hash``, which is salted per process, so every node agrees on the shards.
+
+    Returns:
+        bool:
+        Returns a boolean flag to indicate if the repository/gist is backed up by the shard.
+    """
+    index, count = map(int, shard.split("/"))
+    return int.from_bytes(hashlib.sha256(key.encode()).digest()[:8], "big") % count == index - 1
+
+
+def shard_part(shard: str) -> str:
+    """Get the filename of the part stored by a shard.
+
+    Args:
+        shard: Shard as ``INDEX/COUNT``
+
+    Returns:
+        str:
+        Returns the filename of the part.
+    """
+    index, count = shard.split("/")
+    return f"part-{index}-of-{count}.json"
+
+
+def shard_parts(keys: Iterable[str], prefix: str) -> Dict[int, str]:
+    """Get the parts stored by each shard, once all the shards have stored their parts.
+
+    Args:
+        keys: S3 object keys under the prefix.
+        prefix: Prefix of the parts.
+
+    Raises:
+        ValueError:
+        If any of the parts are missing, or if the parts are from runs with a different number of shards.
+
+    Returns:
+        Dict[int, str]:
+        Returns the S3 object key of each part, mapped to the index of its shard.
+    """
+    parts: Dict[int, Dict[int, str]] = {}
+    for key in keys:
+        if match := re.fullmatch(r"part-(\d+)-of-(\d+)\.json", key.removeprefix(prefix)):
+            parts.setdefault(int(match.group(2)), {})[int(match.group(1))] = key
+    if not parts:
+        raise ValueError(f"No parts found at {prefix!r}")
+    if len(parts) > 1:
+        raise ValueError(f"Parts at {prefix!r} are from runs with {sorted(parts)} shards")
+    count, found = parts.popitem()
+    if missing := sorted(set(range(1, count + 1)) - set(found)):
+        raise ValueError(f"Parts {missing} of {count} are missing at {prefix!r}")
+    return found
+
+
+def listed_size(source: Dict[str, Any]) -> int:
+    """Get the size of a repository/gist from the API response.
+
+    Args:
+        source: Repository/Gist information as a dict.
+
+    See Also:
+        - Repositories have a ``size`` in kilobytes, while gists have the size of each file in bytes.
+
+    Returns:
+        int:
+        Returns the size in bytes, or 0 if it's unavailable.
+    """
+    if files := source.get("files"):
+        return sum(file.get("size") or 0 for file in files.values())
+    return (source.get("size") or 0) * 1024
+
+
+def archive_extension(archive_format: config.ArchiveFormat) -> str:
+    """Get the file extension for an archive format.
+
+    Args:
+        archive_format: Archive format for the backup.
+
+    Returns:
+        str:
+        Returns the file extension without the leading dot.
+    """
+    if archive_format in (config.ArchiveFormat.bundle, config.ArchiveFormat.bundle_incremental):
+        return "bundle"
+    if archive_format == config.ArchiveFormat.tar_gz:
+        return "tar.gz"
+    if archive_format == config.ArchiveFormat.tar_zst:
+        return "tar.zst"
+    return "zip"
+
+
+def manifest_key(datastore: config.DataStore) -> str:
+    """Get the state manifest key for a repository/gist/wiki.
+
+    Args:
+        datastore: DataStore record of the repository/gist information.
+
+    Returns:
+        str:
+        Returns the archive's path relative to the clone directory, without the extension.
+    """
+    visibility = "private" if datastore.private else "public"
+    if datastore.source == config.SourceControl.wiki:
+        return f"{datastore.source.value}/{visibility}/{datastore.name}.wiki"
+    return f"{datastore.source.value}/{visibility}/{datastore.name}"
+
+
+def clone_name(url: str | HttpUrl) -> str:
+    """Get the name of the directory created by ``git clone`` for a URL.
+
+    Args:
+        url: Repository/gist/wiki clone URL.
+
+    Returns:
+        str:
+        Returns the last path component of the URL without the ``.git`` suffix.
+    """
+    return os.path.basename(urlsplit(str(url)).path.rstrip("/")).removesuffix(".git")
+
+
+def repository_missing(error: str) -> bool:
+    """Check if a git command failed because the remote repository doesn't exist.
+
+    Args:
+        error: Standard error of the git command.
+
+    Returns:
+        bool:
+        Returns a boolean flag to indicate if the repository was not found.
+    """
+    return bool(REPOSITORY_MISSING.search(error))
+
+
 def default_logger(env: config.EnvConfig) -> logging.Logger:
     """Generates a default console logger.
 
@@ -114,6 +565,62 @@ def default_logger(env: config.EnvConfig) -> logging.Logger:
     return logger
 
 
+def github_session(env: config.EnvConfig, logger: logging.Logger) -> api.Session:
+    """Creates the HTTP session for the GitHub API.
+
+    Args:
+        env: Environment configuration.
+        logger: Logger object.
+
+    See Also:
+        - The connection pool is sized for the concurrent listings of all the owners that share the session.
+
+    Returns:
+        api.Session:
+        Returns the session with the authorization headers.
+    """
+    session = api.Session(
+        logger=logger,
+        cache_dir=os.path.join(env.backup_dir, config.STATE_DIR, "http") if env.http_cache else None,
+        rate_limit_share=env.rate_limit_share,
+        retries=env.api_retries,
+    )
+    session.headers = {
+        "Accept": "application/vnd.github+json",
+        "Authorization": f"Bearer {env.git_token}",
+        "X-GitHub-Api-Version": "2022-11-28",
+        "Content-Type": "application/x-www-form-urlencoded",
+    }
+    owners = min(env.owner_workers, len(env.git_owners)) if env.git_owners else 1
+    adapter = requests.adapters.HTTPAdapter(
+        pool_maxsize=max(env.api_workers * owners, requests.adapters.DEFAULT_POOLSIZE)
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def worker_pools(env: config.EnvConfig) -> pipeline.Pipeline:
+    """Creates the bounded worker pools for cloning, archiving and uploading.
+
+    Args:
+        env: Environment configuration.
+
+    Returns:
+        pipeline.Pipeline:
+        Returns the pipeline with a stage for each step of the backup.
+    """
+    # git compresses bundles in its own process, so a process pool only helps zip archives
+    archive_processes = env.archive_processes and archive_extension(env.archive_format) != "bundle"
+    return pipeline.Pipeline(
+        clone_workers=env.clone_workers,
+        archive_workers=env.archive_workers,
+        upload_workers=env.upload_workers,
+        archive_processes=archive_processes,
+        disk_budget=env.disk_budget,
+    )
+
+
 def check_file_presence(source_dir: str | os.PathLike) -> int:
     """Get a list of all subdirectories and check for file presence.
 
@@ -122,16 +629,35 @@ def check_file_presence(source_dir: str | os.PathLike) -> int:
 
     Returns:
         int:
-        Returns the total number of zip files cloned.
+        Returns the total number of archives created.
     """
     total_files = 0
     for root, dirs, files in os.walk(source_dir):
         for file in files:
-            if file.endswith(".zip"):
+            if file.endswith(ARCHIVE_EXTENSIONS):
                 total_files += 1
     return total_files
 
 
+def directory_size(source_dir: str | os.PathLike) -> int:
+    """Get the total size of all the files within a directory.
+
+    Args:
+        source_dir: Root directory to get the size of.
+
+    Returns:
+        int:
+        Returns the total size in bytes.
+    """
+    total_size = 0
+    for root, dirs, files in os.walk(source_dir):
+        for file in files:
+            filepath = os.path.join(root, file)
+            if not os.path.islink(filepath):
+                total_size += os.path.getsize(filepath)
+    return total_size
+
+
 def is_within_last_n_days(timestamp_str: str, n_days: int) -> bool:
     """Check if an ISO 8601 timestamp is within the last n days.
 
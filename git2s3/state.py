@@ -0,0 +1,369 @@
+import copy
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Optional, Set
+
+from git2s3 import config, squire
+
+
+class Manifest:
+    # noinspection PyUnresolvedReferences
+    """State manifest to track the last backed up revision of every repository/gist/wiki.
+
+    >>> Manifest
+
+    Keyword Args:
+        env: Environment configuration.
+        logger: Logger object.
+
+    See Also:
+        - Entries are keyed by the archive's path relative to the clone directory, without the extension.
+        - Each entry holds the ``pushed_at``/``updated_at`` timestamp, the HEAD SHA and the S3 object key.
+        - The manifest is stored in S3 (next to the backup and under a stable state key) and cached locally.
+        - A shard only stores its part of the manifest, which is assembled with the other parts by ``merge``
+    """
+
+    def __init__(self, env: config.EnvConfig, logger: logging.Logger):
+        """Instantiates the state manifest for the configured owner."""
+        self.env = env
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.previous: Dict[str, Dict[str, Any]] = {}
+        self.current: Dict[str, Dict[str, Any]] = {}
+        # entries that reference an archive from an earlier run, so they aren't expected to be uploaded in this run
+        self.carried: Set[str] = set()
+        self.cache_file = os.path.join(self.env.backup_dir, config.STATE_DIR, f"{self.env.git_owner}.json")
+        self.state_key = f"{config.STATE_PREFIX}/{self.env.git_owner}.json"
+
+    def load(self, uploader: Optional[Any] = None) -> None:
+        """Loads the previous manifest from S3, falling back to the local cache.
+
+        Args:
+            uploader: ``s3.Uploader`` object to download the manifest from S3.
+        """
+        state = None
+        if uploader:
+            state = uploader.download_json(self.state_key)
+        if state is None and os.path.isfile(self.cache_file):
+            self.logger.info("Loading state manifest from local cache: [%s]", self.cache_file)
+            with open(self.cache_file) as stream:
+                state = json.load(stream)
+        if state:
+            self.previous = state.get("entries", {})
+            self.logger.info(
+                "Loaded state manifest from %s with %d entries",
+                state.get("snapshot"),
+                len(self.previous),
+            )
+        else:
+            self.logger.info("No previous state manifest found, running a full backup.")
+
+    def unchanged(self, key: str, updated_at: Optional[str] = None, head: Optional[str] = None) -> bool:
+        """Check if an entry is unchanged since the last backup.
+
+        Args:
+            key: Manifest key for the entry.
+            updated_at: Latest ``pushed_at``/``updated_at`` timestamp from the API.
+            head: Latest HEAD SHA of the remote.
+
+        Returns:
+            bool:
+            Returns a boolean flag to indicate if the entry can be carried forward.
+        """
+        previous = self.previous.get(key)
+        if not previous or not previous.get("object") or not (head or updated_at):
+            return False
+        # every value that is available has to match
+        if head and previous.get("head") != head:
+            return False
+        if updated_at and previous.get("updated_at") != updated_at:
+            return False
+        return True
+
+    def carry_forward(self, key: str, **extra: Any) -> None:
+        """Carry forward the previous archive reference for an unchanged entry.
+
+        Args:
+            key: Manifest key for the entry.
+            extra: Information to update in the previous entry, like the tips of git bundles whose refs moved.
+        """
+        with self.lock:
+            self.current[key] = {**copy.deepcopy(self.previous[key]), **extra}
+            self.carried.add(key)
+
+    def record(
+        self,
+        key: str,
+        s3_object: str,
+        updated_at: Optional[str] = None,
+        head: Optional[str] = None,
+        **extra: Any,
+    ) -> None:
+        """Records a freshly archived entry.
+
+        Args:
+            key: Manifest key for the entry.
+            s3_object: S3 object key the archive is uploaded to.
+            updated_at: Latest ``pushed_at``/``updated_at`` timestamp from the API.
+            head: HEAD SHA of the cloned repository.
+            extra: Additional information about the archive, like the tips and chain of git bundles.
+        """
+        with self.lock:
+            self.current[key] = {
+                "updated_at": updated_at,
+                "head": head,
+                "object": s3_object,
+                "snapshot": self.env.aws_s3_prefix,
+                **extra,
+            }
+
+    def commit(self, uploaded: Iterable[str], blobs: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """Drop the entries archived in this run that failed to upload, so they are retried in the next run.
+
+        Args:
+            uploaded: S3 object keys that were uploaded successfully.
+            blobs: S3 object keys mapped to the blobs they are stored as, in the content addressed store.
+
+        Returns:
+            Dict[str, Any]:
+            Returns the manifest payload to be stored.
+        """
+        uploaded = set(uploaded)
+        with self.lock:
+            for key, entry in list(self.current.items()):
+                # carried forward entries may share the prefix with this run, when the prefix is fixed
+                if (
+                    key not in self.carried
+                    and entry["object"].startswith(f"{self.env.aws_s3_prefix}/")
+                    and entry["object"] not in uploaded
+                ):
+                    self.logger.warning("Excluding '%s' from state manifest, reason: upload failed", key)
+                    if key in self.previous:
+                        self.current[key] = copy.deepcopy(self.previous[key])
+                    else:
+                        del self.current[key]
+                elif blobs and entry["object"] in blobs:
+                    entry["blob"] = blobs[entry["object"]]
+            return {
+                "owner": self.env.git_owner,
+                "snapshot": self.env.aws_s3_prefix,
+                "created": datetime.now(timezone.utc).isoformat(),
+                "entries": self.current,
+            }
+
+    def save(self, payload: Dict[str, Any], uploader: Optional[Any] = None) -> None:
+        """Stores the manifest in S3 and caches it locally.
+
+        Args:
+            payload: Manifest payload returned by ``commit``.
+            uploader: ``s3.Uploader`` object to upload the manifest to S3.
+        """
+        if uploader and self.env.shard:
+            # the state key is left as is, since it holds the entries of every shard
+            part = f"{self.env.aws_s3_prefix}/{config.MANIFEST_PARTS}/{squire.shard_part(self.env.shard)}"
+            uploader.upload_json(part, payload)
+        elif uploader:
+            uploader.upload_json(f"{self.env.aws_s3_prefix}/{config.MANIFEST_NAME}", payload)
+            uploader.upload_json(self.state_key, payload)
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        with open(self.cache_file, "w") as stream:
+            json.dump(payload, stream, indent=2)
+            stream.flush()
+        self.logger.info("State manifest stored with %d entries", len(payload["entries"]))
+
+    def merge(self, uploader: Any) -> bool:
+        """Assembles the manifest from the parts stored by each shard, once all the shards are complete.
+
+        Args:
+            uploader: ``s3.Uploader`` object to download the parts and upload the manifest.
+
+        Returns:
+            bool:
+            Returns a boolean flag to indicate if the manifest was assembled.
+        """
+        prefix = f"{self.env.aws_s3_prefix}/{config.MANIFEST_PARTS}/"
+        try:
+            parts = squire.shard_parts(uploader.keys(prefix), prefix)
+        except ValueError as error:
+            self.logger.error("Failed to merge the state manifest - %s", error)
+            return False
+        entries = {}
+        for index in sorted(parts):
+            if (part := uploader.download_json(parts[index])) is None:
+                self.logger.error("Failed to merge the state manifest - part %d is unavailable", index)
+                return False
+            # shards don't overlap, so the entries of a part are never replaced by another part
+            entries.update(part["entries"])
+        payload = {
+            "owner": self.env.git_owner,
+            "snapshot": self.env.aws_s3_prefix,
+            "created": datetime.now(timezone.utc).isoformat(),
+            "shards": len(parts),
+            "entries": entries,
+        }
+        self.save(payload, uploader)
+        return True
+
+
+class WikiCache:
+    # noinspection PyUnresolvedReferences
+    """Negative cache of repositories that flag ``has_wiki`` without having a wiki, persisted across runs.
+
+    >>> WikiCache
+
+    Keyword Args:
+        env: Environment configuration.
+        logger: Logger object.
+
+    See Also:
+        - Entries expire after ``wiki_cache_days``, so wikis created in the meantime are picked up eventually.
+    """
+
+    def __init__(self, env: config.EnvConfig, logger: logging.Logger):
+        """Instantiates the negative cache for the configured owner."""
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.ttl = timedelta(days=env.wiki_cache_days).total_seconds()
+        self.missing: Dict[str, float] = {}
+        self.cache_file = os.path.join(env.backup_dir, config.STATE_DIR, f"{env.git_owner}_wikis.json")
+
+    def load(self) -> None:
+        """Loads the unexpired entries from the local cache."""
+        if not self.ttl or not os.path.isfile(self.cache_file):
+            return
+        with open(self.cache_file) as stream:
+            entries = json.load(stream)
+        now = time.time()
+        self.missing = {key: checked for key, checked in entries.items() if now - checked < self.ttl}
+        self.logger.debug("Loaded %d repositories without a wiki from local cache", len(self.missing))
+
+    def is_missing(self, key: str) -> bool:
+        """Check if a wiki was recently found to be missing.
+
+        Args:
+            key: Manifest key for the wiki.
+
+        Returns:
+            bool:
+            Returns a boolean flag to indicate if the wiki is known to be missing.
+        """
+        return key in self.missing
+
+    def add(self, key: str) -> None:
+        """Adds a wiki that is missing to the cache.
+
+        Args:
+            key: Manifest key for the wiki.
+        """
+        if self.ttl:
+            with self.lock:
+                self.missing[key] = time.time()
+
+    def save(self) -> None:
+        """Stores the cache locally."""
+        if not self.ttl:
+            return
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        with self.lock, open(self.cache_file, "w") as stream:
+            json.dump(self.missing, stream, indent=2)
+            stream.flush()
+
+
+class Journal:
+    # noinspection PyUnresolvedReferences
+    """Append-only journal of the progress of a run, to resume it after an interruption.
+
+    >>> Journal
+
+    Keyword Args:
+        env: Environment configuration.
+        logger: Logger object.
+
+    See Also:
+        - Each line is a JSON object with the stage of an entry: ``listed``, ``cloned``, ``archived`` or ``uploaded``
+        - Lines are flushed to disk as they are written, so the journal survives a crash of the process or the host.
+        - A partially written line at the end of the journal is ignored when it is loaded.
+    """
+
+    def __init__(self, env: config.EnvConfig, logger: logging.Logger):
+        """Instantiates the journal for the configured owner."""
+        self.env = env
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.filepath = os.path.join(env.backup_dir, config.STATE_DIR, f"{env.git_owner}_journal.jsonl")
+        self.stream = None
+        self.snapshot: Optional[str] = None
+        self.archived: Dict[str, Dict[str, Any]] = {}
+        self.uploaded: Dict[str, Dict[str, Any]] = {}
+
+    def load(self) -> bool:
+        """Loads the journal of an interrupted run.
+
+        Returns:
+            bool:
+            Returns a boolean flag to indicate if a journal was found.
+        """
+        if not os.path.isfile(self.filepath):
+            return False
+        with open(self.filepath) as stream:
+            for line in stream:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the process died while writing this line
+                    continue
+                if entry["stage"] == "started":
+                    self.snapshot = entry["snapshot"]
+                elif entry["stage"] == "archived":
+                    self.archived[entry["object"]] = entry
+                elif entry["stage"] == "uploaded":
+                    self.uploaded[entry["object"]] = entry
+        self.logger.info(
+            "Loaded journal of snapshot %s with %d archived and %d uploaded objects",
+            self.snapshot,
+            len(self.archived),
+            len(self.uploaded),
+        )
+        return self.snapshot is not None
+
+    def start(self, resume: bool = False) -> None:
+        """Opens the journal for writing.
+
+        Args:
+            resume: Boolean flag to continue the existing journal, instead of starting a new one.
+        """
+        os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
+        self.stream = open(self.filepath, "a" if resume else "w")
+        if not resume:
+            self.write("started", snapshot=self.env.aws_s3_prefix)
+
+    def write(self, stage: str, **entry: Any) -> None:
+        """Appends an entry to the journal.
+
+        Args:
+            stage: Stage the entry reached.
+            entry: Information about the entry, like the manifest key and the S3 object key.
+        """
+        if not self.stream:
+            return
+        line = json.dumps({"stage": stage, "time": time.time(), **entry})
+        with self.lock:
+            self.stream.write(f"{line}\n")
+            self.stream.flush()
+            os.fsync(self.stream.fileno())
+
+    def close(self, remove: bool = False) -> None:
+        """Closes the journal.
+
+        Args:
+            remove: Boolean flag to delete the journal, once the run is complete.
+        """
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        if remove and os.path.isfile(self.filepath):
+            os.remove(self.filepath)
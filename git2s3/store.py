@@ -0,0 +1,221 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Set
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from git2s3 import config, exc, squire
+
+# Blobs that are younger than this are never collected, since a backup in progress may not have saved its snapshot yet
+GC_GRACE_PERIOD: timedelta = timedelta(days=1)
+
+
+class BlobStore:
+    # noinspection PyUnresolvedReferences
+    """Content addressed store, where each archive is stored once under its hash and snapshots reference them.
+
+    >>> BlobStore
+
+    Keyword Args:
+        env: Environment configuration.
+        logger: Logger object.
+        s3_client: S3 client object.
+
+    See Also:
+        - Blobs are stored at ``Git2S3_Blobs/<sha256[:2]>/<sha256>.<extension>``, and shared across owners.
+        - Each snapshot is a manifest at ``Git2S3_Snapshots/<owner>/<prefix>.json``, which maps archive paths to blobs.
+        - A shard stores its part at ``Git2S3_Snapshots/<owner>/<prefix>/part-<index>-of-<count>.json`` instead.
+        - Blobs that are not referenced by any of the retained snapshots are deleted by garbage collection.
+    """
+
+    def __init__(self, env: config.EnvConfig, logger: logging.Logger, s3_client: Any):
+        """Instantiates the content addressed store."""
+        self.env = env
+        self.logger = logger
+        self.s3_client = s3_client
+        self.bucket = env.aws_bucket_name
+        self.lock = threading.Lock()
+        self.blobs: Dict[str, str] = {}
+        self.deduplicated: int = 0
+
+    @staticmethod
+    def blob_key(digest: str, extension: str) -> str:
+        """Get the S3 object key for a blob.
+
+        Args:
+            digest: SHA-256 hex digest of the content.
+            extension: File extension of the archive, including the leading dot.
+
+        Returns:
+            str:
+            Returns the S3 object key of the blob.
+        """
+        return f"{config.BLOB_PREFIX}/{digest[:2]}/{digest}{extension}"
+
+    def exists(self, key: str) -> bool:
+        """Check if an object exists in the bucket.
+
+        Args:
+            key: S3 object key.
+
+        Returns:
+            bool:
+            Returns a boolean flag to indicate if the object exists.
+        """
+        try:
+            self.s3_client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except ClientError as error:
+            if error.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return False
+            raise
+
+    def put(self, local_file_path: str | os.PathLike, s3_file_path: str) -> str:
+        """Uploads an archive as a blob, unless a blob with the same content already exists.
+
+        Args:
+            local_file_path: Local file path to upload from.
+            s3_file_path: S3 file path of the archive within the snapshot.
+
+        Returns:
+            str:
+            Returns the S3 object key of the blob.
+        """
+        digest = hashlib.sha256()
+        with open(local_file_path, "rb") as stream:
+            while chunk := stream.read(1024 * 1024):
+                digest.update(chunk)
+        extension = next(
+            (ext for ext in squire.ARCHIVE_EXTENSIONS if s3_file_path.endswith(ext)), os.path.splitext(s3_file_path)[1]
+        )
+        key = self.blob_key(digest.hexdigest(), extension)
+        if self.exists(key):
+            self.logger.info("Skipped uploading '%s', reason: identical blob '%s' exists", s3_file_path, key)
+            with self.lock:
+                self.deduplicated += 1
+        else:
+            self.s3_client.upload_file(local_file_path, self.bucket, key)
+            self.logger.info("Uploaded '%s' to 's3://%s/%s'", s3_file_path, self.bucket, key)
+        with self.lock:
+            self.blobs[s3_file_path] = key
+        return key
+
+    def save(self, objects: Dict[str, str]) -> None:
+        """Stores the snapshot manifest.
+
+        Args:
+            objects: Archive paths relative to the snapshot prefix, mapped to their blobs.
+        """
+        key = f"{config.SNAPSHOT_PREFIX}/{self.env.git_owner}/{self.env.aws_s3_prefix}.json"
+        if self.env.shard:
+            key = f"{key.removesuffix('.json')}/{squire.shard_part(self.env.shard)}"
+        payload = {
+            "owner": self.env.git_owner,
+            "snapshot": self.env.aws_s3_prefix,
+            "created": datetime.now(timezone.utc).isoformat(),
+            "objects": objects,
+        }
+        try:
+            self.s3_client.put_object(
+                Bucket=self.bucket,
+                Key=key,
+                Body=json.dumps(payload, indent=2).encode(),
+                ContentType="application/json",
+            )
+        except (BotoCoreError, ClientError) as error:
+            raise exc.UploadError(error)
+        self.logger.info("Snapshot manifest stored at '%s' with %d objects", key, len(objects))
+
+    def merge(self) -> bool:
+        """Assembles the snapshot manifest from the parts stored by each shard.
+
+        See Also:
+            - Parts are retained, and expire along with the other snapshots when running garbage collection.
+
+        Returns:
+            bool:
+            Returns a boolean flag to indicate if the snapshot manifest was assembled.
+        """
+        prefix = f"{config.SNAPSHOT_PREFIX}/{self.env.git_owner}/{self.env.aws_s3_prefix}/"
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        try:
+            keys = [
+                content["Key"]
+                for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix)
+                for content in page.get("Contents", [])
+            ]
+            parts = squire.shard_parts(keys, prefix)
+            objects = {}
+            for key in parts.values():
+                objects.update(
+                    json.loads(self.s3_client.get_object(Bucket=self.bucket, Key=key)["Body"].read())["objects"]
+                )
+        except (BotoCoreError, ClientError, ValueError) as error:
+            self.logger.error("Failed to merge the snapshot manifest - %s", error)
+            return False
+        self.save(objects)
+        return True
+
+    def gc(self) -> int:
+        """Deletes the expired snapshots, and the blobs that are not referenced by any of the retained snapshots.
+
+        See Also:
+            - Snapshots of all the owners are considered, since blobs are shared across owners.
+            - The latest snapshot of each owner is always retained, regardless of its age.
+            - Nothing is deleted when ``dry_run`` is enabled.
+            - Should not run alongside a backup that deduplicates against older blobs, to avoid deleting those.
+
+        Returns:
+            int:
+            Returns the number of blobs that were deleted.
+        """
+        now = datetime.now(timezone.utc)
+        cutoff = now - timedelta(days=self.env.retention_days)
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        snapshots = []
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=f"{config.SNAPSHOT_PREFIX}/"):
+            for content in page.get("Contents", []):
+                payload = json.loads(self.s3_client.get_object(Bucket=self.bucket, Key=content["Key"])["Body"].read())
+                snapshots.append((content["Key"], payload))
+        latest = {}
+        for key, payload in snapshots:
+            if payload["created"] > latest.get(payload["owner"], ""):
+                latest[payload["owner"]] = payload["created"]
+        referenced: Set[str] = set()
+        expired = []
+        for key, payload in snapshots:
+            created = datetime.fromisoformat(payload["created"])
+            if created < cutoff and payload["created"] != latest[payload["owner"]]:
+                expired.append(key)
+            else:
+                referenced.update(payload["objects"].values())
+        unreferenced = []
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=f"{config.BLOB_PREFIX}/"):
+            for content in page.get("Contents", []):
+                if content["Key"] not in referenced and content["LastModified"] < now - GC_GRACE_PERIOD:
+                    unreferenced.append(content["Key"])
+        self.logger.info(
+            "Garbage collection: %d / %d snapshots expired, %d blobs unreferenced",
+            len(expired),
+            len(snapshots),
+            len(unreferenced),
+        )
+        if self.env.dry_run:
+            self.logger.info("Dry run is set to true, skipping deletion.")
+            return 0
+        # snapshots go first, so an interruption never leaves a snapshot pointing to deleted blobs
+        keys = expired + unreferenced
+        # delete requests are limited to 1,000 keys each
+        for start in range(0, len(keys), 1000):
+            end = start + 1000
+            response = self.s3_client.delete_objects(
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": key} for key in keys[start:end]], "Quiet": True},
+            )
+            for error in response.get("Errors", []):
+                self.logger.error("Failed to delete '%s' - %s", error["Key"], error.get("Message"))
+        return len(unreferenced)
@@ -0,0 +1,119 @@
+import contextlib
+import json
+import os
+import threading
+import time
+from collections.abc import Generator
+from typing import Any, Dict, List, Tuple
+
+
+class Tracer:
+    # noinspection PyUnresolvedReferences
+    """Records a span for every operation of a run, and stores them as a Chrome trace.
+
+    >>> Tracer
+
+    See Also:
+        - Each span holds the process and the thread it ran on, so every worker gets its own track in the timeline.
+        - Timestamps are based on the wall clock, so spans from the archive process pool line up with the rest.
+        - The trace can be opened with https://ui.perfetto.dev or ``chrome://tracing``
+
+    References:
+        https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU
+    """
+
+    def __init__(self):
+        """Instantiates the tracer with an empty timeline."""
+        self.lock = threading.Lock()
+        self.events: List[Dict[str, Any]] = []
+        self.threads: Dict[Tuple[int, str], int] = {}
+
+    def tid(self, pid: int, thread: str) -> int:
+        """Get a stable track ID for a thread, since thread identifiers are reused once a thread exits.
+
+        Args:
+            pid: Process ID the thread belongs to.
+            thread: Name of the thread.
+
+        Returns:
+            int:
+            Returns the track ID for the thread.
+        """
+        if (pid, thread) not in self.threads:
+            self.threads[(pid, thread)] = len(self.threads) + 1
+        return self.threads[(pid, thread)]
+
+    def add(self, name: str, start: float, seconds: float, pid: int, thread: str, **args: Any) -> None:
+        """Adds a completed span to the timeline.
+
+        Args:
+            name: Name of the operation.
+            start: Wall clock time when the operation started.
+            seconds: Number of seconds the operation took.
+            pid: Process ID the operation ran on.
+            thread: Name of the thread the operation ran on.
+            args: Additional information about the operation, like the repository.
+        """
+        with self.lock:
+            self.events.append(
+                {
+                    "name": name,
+                    "cat": "git2s3",
+                    "ph": "X",
+                    "ts": round(start * 1_000_000),
+                    "dur": round(seconds * 1_000_000),
+                    "pid": pid,
+                    "tid": self.tid(pid, thread),
+                    "args": args,
+                }
+            )
+
+    @contextlib.contextmanager
+    def span(self, name: str, **args: Any) -> Generator[None]:
+        """Records a span for the operation within the context manager, on the current thread.
+
+        Args:
+            name: Name of the operation.
+            args: Additional information about the operation, like the repository.
+        """
+        start = time.time()
+        counter = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(
+                name,
+                start,
+                time.perf_counter() - counter,
+                os.getpid(),
+                threading.current_thread().name,
+                **args,
+            )
+
+    def save(self, filepath: str | os.PathLike) -> None:
+        """Stores the timeline in the Chrome trace event format.
+
+        Args:
+            filepath: Filepath to store the trace.
+        """
+        main = os.getpid()
+        with self.lock:
+            metadata = [
+                {
+                    "name": "process_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "args": {"name": "git2s3" if pid == main else f"archive worker {pid}"},
+                }
+                for pid in sorted({pid for pid, _ in self.threads})
+            ]
+            metadata += [
+                {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": thread}}
+                for (pid, thread), tid in self.threads.items()
+            ]
+            payload = {"traceEvents": metadata + self.events, "displayTimeUnit": "ms"}
+        if directory := os.path.dirname(filepath):
+            os.makedirs(directory, exist_ok=True)
+        with open(filepath, "w") as stream:
+            json.dump(payload, stream)
+            stream.flush()
@@ -0,0 +1,64 @@
+import io
+import os
+import zipfile
+
+import pytest
+
+from git2s3 import config, squire
+
+
+class Sink:
+    """Writable, non-seekable file object that records the size of each write."""
+
+    def __init__(self):
+        self.buffer = io.BytesIO()
+        self.largest = 0
+
+    def write(self, data: bytes) -> int:
+        """Records the size of the write, and buffers the data."""
+        self.largest = max(self.largest, len(data))
+        return self.buffer.write(data)
+
+    def flush(self) -> None:
+        """Nothing to flush, the data is already buffered."""
+        pass
+
+
+@pytest.fixture
+def repository(tmp_path):
+    """Directory with files larger than a copy chunk, both already compressed and compressible."""
+    source = tmp_path / "repo"
+    (source / ".git" / "objects" / "pack").mkdir(parents=True)
+    (source / ".git" / "objects" / "pack" / "pack-1.pack").write_bytes(os.urandom(4 * squire.COPY_CHUNK_SIZE))
+    (source / "random.bin").write_bytes(os.urandom(4 * squire.COPY_CHUNK_SIZE))
+    (source / "text.txt").write_text("git2s3\n" * squire.COPY_CHUNK_SIZE)
+    (source / "empty.txt").write_text("")
+    return source
+
+
+@pytest.mark.parametrize("archive_format", [config.ArchiveFormat.zip_store, config.ArchiveFormat.tar_gz])
+def test_stored_writes_are_bounded(repository, archive_format):
+    """Files are copied into the archive in chunks, instead of a single write per file."""
+    sink = Sink()
+    squire.archive_stream(repository, sink, archive_format)
+    assert sink.largest <= squire.COPY_CHUNK_SIZE
+
+
+@pytest.mark.parametrize("level", [None, 1, 9])
+def test_deflated_writes_are_bounded(repository, level):
+    """Compressed output is written per chunk, and the archive is still valid."""
+    sink = Sink()
+    squire.zip_stream(repository, sink, level=level)
+    # deflate adds a few bytes per block to data that doesn't compress
+    assert sink.largest <= squire.COPY_CHUNK_SIZE * 1.01
+    with zipfile.ZipFile(sink.buffer) as zf:
+        assert zf.testzip() is None
+        assert zf.read("text.txt") == (repository / "text.txt").read_bytes()
+
+
+def test_compression_level_is_applied(repository):
+    """Compression level is applied to every deflated entry."""
+    fastest, smallest = Sink(), Sink()
+    squire.zip_stream(repository, fastest, level=1)
+    squire.zip_stream(repository, smallest, level=9)
+    assert len(smallest.buffer.getvalue()) < len(fastest.buffer.getvalue())
@@ -0,0 +1,50 @@
+import logging
+
+import pytest
+
+from git2s3 import config, state
+
+
+@pytest.fixture
+def manifest(tmp_path, monkeypatch):
+    """State manifest of a backup with a fixed prefix, and a previous run that backed up two repos."""
+    monkeypatch.chdir(tmp_path)
+    env = config.EnvConfig(
+        git_owner="owner",
+        git_token="token",
+        aws_bucket_name="bucket",
+        aws_s3_prefix="fixed",
+        backup_dir=tmp_path,
+        incremental=True,
+    )
+    manifest = state.Manifest(env, logging.getLogger(__name__))
+    manifest.previous = {
+        key: {"updated_at": "2024-01-01T00:00:00Z", "head": None, "object": f"fixed/{key}.zip", "snapshot": "fixed"}
+        for key in ("repo/public/unchanged", "repo/public/changed")
+    }
+    return manifest
+
+
+def test_carried_forward_entries_are_kept(manifest, caplog):
+    """Unchanged entries under a fixed prefix aren't uploaded again, and aren't reported as failed uploads."""
+    manifest.carry_forward("repo/public/unchanged")
+    manifest.record("repo/public/changed", "fixed/repo/public/changed.zip", "2024-02-01T00:00:00Z")
+    with caplog.at_level(logging.WARNING):
+        payload = manifest.commit(["fixed/repo/public/changed.zip"])
+    assert not caplog.records
+    assert payload["entries"]["repo/public/unchanged"] == manifest.previous["repo/public/unchanged"]
+    assert payload["entries"]["repo/public/changed"]["updated_at"] == "2024-02-01T00:00:00Z"
+
+
+def test_failed_uploads_are_excluded(manifest, caplog):
+    """Entries archived in this run that failed to upload fall back to the previous entry."""
+    manifest.carry_forward("repo/public/unchanged")
+    manifest.record("repo/public/changed", "fixed/repo/public/changed.zip", "2024-02-01T00:00:00Z")
+    manifest.record("repo/public/new", "fixed/repo/public/new.zip", "2024-02-01T00:00:00Z")
+    with caplog.at_level(logging.WARNING):
+        payload = manifest.commit([])
+    assert {record.getMessage() for record in caplog.records} == {
+        "Excluding 'repo/public/changed' from state manifest, reason: upload failed",
+        "Excluding 'repo/public/new' from state manifest, reason: upload failed",
+    }
+    assert payload["entries"] == manifest.previous